@@ -1,11 +1,26 @@
+import sys
+from pathlib import Path
+
 from flask import Flask
 
+# Make parser importable — in the Docker image it lives at /srv/parser.
+# Done here, before any submodule loads, since json_provider shares the
+# parser's JSON encoder and routes imports the pipeline.
+_parser_dir = str(Path(__file__).resolve().parent.parent / "parser")
+if _parser_dir not in sys.path:
+    sys.path.insert(0, _parser_dir)
+
+from . import compress, frontend, json_provider  # noqa: E402
+
 
 def create_app():
     app = Flask(__name__, static_folder=None)
+    json_provider.init_app(app)
+    compress.init_app(app)
 
-    from .routes import bp
+    from .routes import STATIC_DIR, bp
 
     app.register_blueprint(bp)
+    frontend.init_app(app, STATIC_DIR)
 
     return app
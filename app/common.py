@@ -0,0 +1,411 @@
+"""API logic shared by :mod:`app.routes` and the standalone ``server.py``.
+
+Both serve the same endpoints over the same data/ directory. The cached
+listings, trace serving, source validation, process pool and the
+/api/process response live here once, and each server's routes call in.
+"""
+
+import gzip
+import multiprocessing
+import os
+import re
+import stat
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+from flask import Response, abort, jsonify, request
+from werkzeug.security import safe_join
+
+from . import compress, json_provider
+
+# The pipeline is imported here rather than per request, so a preloaded
+# app shares it with every forked worker. The package __init__ has put
+# parser/ on sys.path.
+from run import deal_to_dict
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "mosiacs"
+DATA_DIR = STATIC_DIR / "data"
+JSON_DIR = DATA_DIR / "json"
+
+# Source types the pipeline accepts, as a tuple for str.endswith
+ALLOWED_EXTENSIONS = (".c", ".py")
+
+# Read size when writing uploads to disk
+UPLOAD_CHUNK = 1 << 20
+
+# Anything that could leave data/: a path separator, a "..", or a NUL
+_BAD_FILENAME = re.compile(r"[/\\\x00]|\.\.")
+
+# Directory prefixes for per-file paths in /api/process; names have passed
+# _BAD_FILENAME by then, so plain concatenation is safe
+_DATA_PREFIX = f"{DATA_DIR}{os.sep}"
+_JSON_PREFIX = f"{JSON_DIR}{os.sep}"
+
+
+# ── Directory snapshots ──────────────────────────────────────────────
+
+# Each holds a value derived from one directory's contents, keyed by the
+# directory's mtime: a file appearing or disappearing bumps it.
+_code_listing = {"mtime_ns": None, "value": None}
+_trace_listing = {"mtime_ns": None, "value": None}
+_data_files = {"mtime_ns": None, "value": None}
+
+
+def _snapshot(cache, directory, build):
+    """Return ``build()``, rebuilt only when ``directory``'s mtime changes.
+
+    Returns None if ``directory`` does not exist.
+    """
+    try:
+        mtime_ns = os.stat(directory).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if mtime_ns != cache["mtime_ns"]:
+        cache["value"] = build()
+        cache["mtime_ns"] = mtime_ns
+    return cache["value"]
+
+
+def _scan_code_files():
+    # DirEntry.is_file() answers from the directory read where the
+    # filesystem reports types, so most entries need no stat()
+    with os.scandir(DATA_DIR) as it:
+        files = sorted(
+            e.name for e in it if e.name.endswith(ALLOWED_EXTENSIONS) and e.is_file()
+        )
+    return json_provider.dumps(files)
+
+
+def _scan_traces():
+    files = sorted(f for f in os.listdir(JSON_DIR) if f.endswith(".json"))
+    return json_provider.dumps(files)
+
+
+def _scan_data_files():
+    # One directory read in place of a stat() per requested file. This
+    # replaces a per-name lru_cache keyed by data/'s mtime: each upload or
+    # delete left every cached answer dead, and the next request stat()ed
+    # each name again.
+    with os.scandir(DATA_DIR) as it:
+        return frozenset(e.name for e in it if e.is_file())
+
+
+def code_files_response():
+    """List the .c and .py source files in data/, sorted."""
+    body = _snapshot(_code_listing, DATA_DIR, _scan_code_files)
+    return Response(body or b"[]", mimetype="application/json")
+
+
+def traces_response():
+    """List the saved trace files in data/json/, sorted."""
+    body = _snapshot(_trace_listing, JSON_DIR, _scan_traces)
+    return Response(body or b"[]", mimetype="application/json")
+
+
+# ── Traces ───────────────────────────────────────────────────────────
+
+# Bytes of trace payloads kept in memory, per process
+TRACE_CACHE_BYTES = 64 << 20
+
+# Recently served payloads, least recent first, keyed by
+# (path, mtime_ns, size, gzipped); _trace_cache_size is their total size
+_trace_cache = OrderedDict()
+_trace_cache_size = 0
+_trace_cache_lock = threading.Lock()
+
+
+def _trace_payload(path, mtime_ns, size, gzipped):
+    """Return a trace's bytes, gzip-compressed if asked, kept in memory.
+
+    ``mtime_ns`` and ``size`` only key the cache, so a trace rewritten by
+    /api/process misses and is read afresh. The cache holds at most
+    :data:`TRACE_CACHE_BYTES`, dropping the least recently served first.
+    """
+    global _trace_cache_size
+    key = (path, mtime_ns, size, gzipped)
+    with _trace_cache_lock:
+        payload = _trace_cache.get(key)
+        if payload is not None:
+            _trace_cache.move_to_end(key)
+            return payload
+    with open(path, "rb") as f:
+        payload = f.read()
+    if gzipped:
+        payload = gzip.compress(payload, compresslevel=compress.LEVEL)
+    with _trace_cache_lock:
+        if key not in _trace_cache and len(payload) <= TRACE_CACHE_BYTES:
+            _trace_cache[key] = payload
+            _trace_cache_size += len(payload)
+            while _trace_cache_size > TRACE_CACHE_BYTES:
+                _, dropped = _trace_cache.popitem(last=False)
+                _trace_cache_size -= len(dropped)
+    return payload
+
+
+def trace_response(filename):
+    """Serve a saved trace from data/json/ as-is.
+
+    The file is already JSON, so its bytes are sent without being decoded
+    and re-encoded. Recently served traces are kept in memory (gzipped
+    for clients that accept it); responses carry an ETag and honour
+    If-None-Match.
+    """
+    path = safe_join(str(JSON_DIR), filename)
+    try:
+        st = os.stat(path) if path else None
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        abort(404)
+    gzipped = bool(request.accept_encodings["gzip"])
+    payload = _trace_payload(path, st.st_mtime_ns, st.st_size, gzipped)
+    response = Response(payload, mimetype="application/json")
+    response.set_etag(f"{st.st_mtime_ns:x}-{st.st_size:x}" + ("-gz" if gzipped else ""))
+    response.last_modified = st.st_mtime
+    if gzipped:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=len(payload)
+    )
+
+
+# ── Processing ───────────────────────────────────────────────────────
+
+# Size of each server process's pool; SPIRAL_PROCESS_WORKERS overrides
+# the CPU count. A server running several processes gives each its own
+# pool, so it should set this lower (see server.py's _serve_production).
+PROCESS_WORKERS = int(os.environ.get("SPIRAL_PROCESS_WORKERS") or 0) or os.cpu_count() or 1
+
+# Runs one /api/process request keeps in the pool at a time; one more
+# than the pool can work on, so a finished result is always waiting
+_IN_FLIGHT = PROCESS_WORKERS + 1
+
+# Worker processes for /api/process batches, started on first use
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    # Requests arrive on several threads; only one may start the pool
+    with _executor_lock:
+        if _executor is None:
+            # The pool starts from a request thread; forking a process
+            # with other threads running can leave held locks behind in
+            # the child, so workers come from a forkserver instead
+            _executor = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+    return _executor
+
+
+def _discard_executor(executor):
+    """Drop ``executor`` after one of its workers died; the next use starts a new pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(path):
+    """Start a scratch run of ``path`` in the pool.
+
+    Returns ``(executor, future)``, or None when even a fresh pool cannot
+    take the job, in which case the caller runs it itself.
+    """
+    for _ in range(2):
+        executor = _get_executor()
+        try:
+            return executor, executor.submit(deal_to_dict, path, -1, scratch=True)
+        except BrokenProcessPool:
+            _discard_executor(executor)
+    return None
+
+
+def _resolve_source(filename, existing):
+    """Return ``(input_path, None)`` for a valid name, else ``(None, message)``."""
+    # Security check
+    if _BAD_FILENAME.search(filename):
+        return None, "Invalid filename"
+    if filename not in existing:
+        return None, "File not found"
+    return _DATA_PREFIX + filename, None
+
+
+def process_response(data, keep_failed=False):
+    """Run the files named in an /api/process request body; return the response.
+
+    Each result is saved to data/json/ and streamed back. Results whose
+    run failed go to "errors", unless ``keep_failed`` is set: then they
+    are saved and returned too, with a "warning", so the front end can
+    still show partial traces. As before streaming, the status is 400
+    with only "errors" when no file produces a result, and 200 otherwise.
+    """
+    if not data or "files" not in data:
+        return jsonify({
+            "success": False,
+            "error": {"stage": "request", "message": "No files specified"}
+        }), 400
+
+    files = data["files"]
+    if not isinstance(files, list) or len(files) == 0:
+        return jsonify({
+            "success": False,
+            "error": {"stage": "request", "message": "Files must be a non-empty array"}
+        }), 400
+
+    errors = []
+    jobs = []
+
+    existing = _snapshot(_data_files, DATA_DIR, _scan_data_files) or frozenset()
+    for filename in files:
+        input_path, message = _resolve_source(filename, existing)
+        if message:
+            errors.append({"file": filename, "stage": "validation", "message": message})
+            continue
+
+        jobs.append((filename, input_path))
+
+    if not jobs:
+        # Every file failed validation; nothing to run
+        return jsonify({
+            "success": False,
+            "errors": errors
+        }), 400
+
+    # Files are instrumented, compiled and run independently, so a batch
+    # is spread across worker processes. Each run builds in its own scratch
+    # directory, so runs of the same file (here or in another request)
+    # cannot overwrite each other's artifacts; a file listed twice is still
+    # only run once.
+    remaining = Counter(path for _, path in jobs)
+    # Paths not yet handed to the pool, in request order; a lone file is
+    # run in this thread
+    queued = deque(remaining) if len(remaining) > 1 else deque()
+    # path -> (executor, future) for runs in the pool
+    pending = {}
+    done = {}
+
+    def submit_more():
+        # Only _IN_FLIGHT runs are started ahead of the one being sent,
+        # so finished results waiting in their futures stay bounded
+        while queued and len(pending) < _IN_FLIGHT:
+            path = queued.popleft()
+            submitted = _submit(path)
+            if submitted is None:
+                queued.appendleft(path)
+                return
+            pending[path] = submitted
+
+    def run(input_path):
+        submitted = pending.pop(input_path, None)
+        if submitted is not None:
+            executor, future = submitted
+            try:
+                return future.result()
+            except (BrokenProcessPool, CancelledError):
+                # A worker died (killed for memory, crashed), or another
+                # request found that and dropped the pool: replace it, move
+                # its other runs to the new one and run this file here
+                # rather than risk it again
+                _discard_executor(executor)
+                moved = [p for p, (owner, _) in pending.items() if owner is executor]
+                for path in moved:
+                    del pending[path]
+                queued.extendleft(reversed(moved))
+        elif input_path in queued:
+            # The pool could not take it
+            queued.remove(input_path)
+        return deal_to_dict(input_path, seed=-1, scratch=True)
+
+    def entries():
+        # Each file's entry is encoded and yielded as soon as it is done;
+        # besides it, at most _IN_FLIGHT results wait in their futures
+        for filename, input_path in jobs:
+            # Process the file
+            try:
+                # Run the parser, unless an earlier listing of the file did
+                result = done.pop(input_path, None)
+                if result is None:
+                    result = run(input_path)
+                    submit_more()
+                remaining[input_path] -= 1
+                if remaining[input_path]:
+                    done[input_path] = result
+
+                is_success = result.get("success", False)
+                if not is_success and not keep_failed:
+                    errors.append({
+                        "file": filename,
+                        "stage": result.get("error", {}).get("stage", "unknown"),
+                        "message": result.get("error", {}).get("message", "Unknown error")
+                    })
+                    continue
+
+                # Save to data/json directory
+                JSON_DIR.mkdir(parents=True, exist_ok=True)
+                save_name = f"{os.path.splitext(filename)[0]}.json"
+                save_path = _JSON_PREFIX + save_name
+                # Encoded once: the saved file's bytes are also the entry's
+                # "data" field
+                body = json_provider.dumps(result, indent=True)
+                # Written aside and renamed into place, so a concurrent
+                # request saving the same file never leaves it half-written
+                tmp_path = f"{save_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(body)
+                os.replace(tmp_path, save_path)
+
+                fields = {"file": filename, "output": save_name, "success": is_success}
+                if keep_failed:
+                    fields["warning"] = (
+                        result.get("error", {}).get("message") if not is_success else None
+                    )
+                entry = json_provider.dumps(fields)[:-1] + b',"data":' + body + b"}"
+
+            except Exception as e:
+                errors.append({
+                    "file": filename,
+                    "stage": "processing",
+                    "message": str(e)
+                })
+                continue
+
+            yield entry
+
+    # The status line goes out before the body, so nothing is sent until
+    # the first result is in: a request whose every file fails still gets
+    # a 400 with the errors, rather than a 200 it cannot take back
+    submit_more()
+    results = entries()
+    first = next(results, None)
+    if first is None:
+        return jsonify({
+            "success": False,
+            "errors": errors
+        }), 400
+
+    def generate():
+        # The remaining entries are sent as they finish. The summary
+        # fields follow the results array, in the same object.
+        processed = 1
+        yield b'{"results":[' + first
+        for entry in results:
+            yield b"," + entry
+            processed += 1
+
+        summary = json_provider.dumps({
+            "success": True,
+            "processed": processed,
+            "errors": errors if errors else None
+        })
+        # Splice the summary's fields in after the results array
+        yield b"]," + summary[1:]
+
+    return Response(generate(), mimetype="application/json")
@@ -0,0 +1,77 @@
+"""gzip for JSON responses, for clients that accept it.
+
+Trace JSON repeats the same keys and short values throughout, so even
+the fastest compression level shrinks it several times over.
+"""
+
+import gzip
+import zlib
+
+from flask import request
+
+# Bodies smaller than this are sent as they are
+MIN_SIZE = 4096
+# Most of the size reduction on trace JSON, for little CPU
+LEVEL = 1
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            # Flush each chunk so the client gets it now, not when zlib's
+            # buffer happens to fill
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Close the wrapped body (an open file for send_from_directory)
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    """``after_request`` hook gzipping JSON bodies when the client allows it.
+
+    Streamed bodies are compressed chunk by chunk as they are sent.
+    Responses that already carry a Content-Encoding (such as the
+    pre-gzipped traces from /api/trace) are left alone. Files from
+    ``send_from_directory`` get ``-gz`` on their ETag, as /api/trace does,
+    so the gzipped and plain bodies are never mistaken for each other.
+    """
+    if (
+        response.mimetype != "application/json"
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or request.method == "HEAD"
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    if not request.accept_encodings["gzip"]:
+        return response
+    if not response.is_streamed and len(response.get_data()) < MIN_SIZE:
+        return response
+    etag, weak = response.get_etag()
+    if etag:
+        # send_file compared If-None-Match with the plain ETag; compare
+        # it again with the one the client was actually given
+        etag += "-gz"
+        response.set_etag(etag, weak)
+        response.headers.pop("Accept-Ranges", None)
+        if request.if_none_match.contains_weak(etag):
+            response.status_code = 304
+            return response
+    if response.is_streamed:
+        response.response = _gzip_stream(response.response)
+        response.headers.pop("Content-Length", None)
+    else:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=LEVEL))
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+def init_app(app):
+    """Register :func:`compress_response` on ``app``."""
+    app.after_request(compress_response)
@@ -0,0 +1,45 @@
+"""Serve the front-end's files with WhiteNoise when it is installed.
+
+WhiteNoise stats the files once at startup and answers with precomputed
+ETag, Last-Modified and Cache-Control headers. It hands file bodies to
+the WSGI server's file wrapper, so gunicorn can use sendfile. data/ is
+left to Flask's routes: traces and sources there are written while the
+app runs, and WhiteNoise's startup snapshot of them would go stale.
+"""
+
+try:
+    from whitenoise import WhiteNoise
+except ImportError:  # optional; Flask's static routes serve everything
+    WhiteNoise = None
+
+# Cache lifetime for front-end assets, in seconds
+MAX_AGE = 3600
+
+
+def _revalidate_index(headers, path, url):
+    # index.html names the other assets, so browsers check it every time
+    if url == "/":
+        headers["Cache-Control"] = "no-cache"
+
+
+if WhiteNoise is not None:
+
+    class _FrontendFiles(WhiteNoise):
+        """WhiteNoise over the front-end directory, minus data/."""
+
+        def add_file_to_dictionary(self, url, path, stat_cache=None):
+            if not url.startswith("/data/"):
+                super().add_file_to_dictionary(url, path, stat_cache=stat_cache)
+
+
+def init_app(app, static_dir):
+    """Put WhiteNoise in front of ``app`` for ``static_dir``, if available."""
+    if WhiteNoise is None:
+        return
+    app.wsgi_app = _FrontendFiles(
+        app.wsgi_app,
+        root=static_dir,
+        index_file=True,
+        max_age=MAX_AGE,
+        add_headers_function=_revalidate_index,
+    )
@@ -0,0 +1,63 @@
+"""JSON encoding with orjson when it is installed.
+
+orjson is an optional speed-up: :func:`init_app` leaves Flask's stdlib
+provider in place, and :func:`dumps` uses :mod:`json`, when it cannot be
+imported. :func:`dumps` is the parser's ``jsonenc.dumps``, so the app and
+the pipeline's CLI encode alike. Decoding stays with :mod:`json`
+throughout, since orjson reads integers wider than 64 bits (trace seeds)
+as floats.
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+from jsonenc import dumps, orjson  # noqa: F401  (dumps is re-exported)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """:class:`DefaultJSONProvider` with orjson doing the encoding.
+
+    Keys are sorted, output is compact unless in debug mode, and dates are
+    HTTP dates, as with the stdlib provider. Two things differ. Non-ASCII
+    text is written as UTF-8 rather than ``\\u`` escapes, because orjson
+    ignores ``ensure_ascii``. NaN and infinities become ``null`` rather
+    than the non-standard ``NaN``/``Infinity``. Values orjson rejects, such
+    as trace seeds wider than 64 bits, and calls passing :func:`json.dumps`
+    options fall back to the stdlib encoder.
+    """
+
+    def _encode(self, obj, indent=False, newline=False):
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if newline:
+            option |= orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs:
+            try:
+                return self._encode(obj).decode("utf-8")
+            except orjson.JSONEncodeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            body = self._encode(obj, indent, newline=True)
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        # The encoded bytes are the whole body: no further copy or encoding
+        # on the way out, and Content-Length is set from them
+        return self._app.response_class(
+            body, mimetype=self.mimetype, direct_passthrough=True
+        )
+
+
+def init_app(app):
+    """Switch ``app`` to :class:`OrjsonProvider` if orjson is available."""
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
@@ -0,0 +1,5 @@
+"""WSGI entry point for production servers, e.g. ``gunicorn app.wsgi:app``."""
+
+from . import create_app
+
+app = create_app()
@@ -0,0 +1,29 @@
+"""JSON encoding to bytes, with orjson when it is installed.
+
+Shared by the pipeline's CLI output (run.py) and the web app, so both
+encode, and fall back, the same way.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # optional; json does the same job, more slowly
+    orjson = None
+
+
+def dumps(obj, indent=False) -> bytes:
+    """Serialize ``obj`` to UTF-8 JSON bytes, with orjson when it can.
+
+    ``indent`` gives the two-space layout of ``json.dump(..., indent=2)``.
+    orjson rejects integers wider than 64 bits, as many trace seeds are;
+    those, like everything when orjson is missing, go through json.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        except orjson.JSONEncodeError:
+            pass
+    if indent:
+        return json.dumps(obj, indent=2).encode("utf-8")
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
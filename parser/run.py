@@ -10,9 +10,9 @@ import json
 import os
 import subprocess
 import sys
+import tempfile
 
-from tree_sitter import Parser
-
+from jsonenc import dumps
 from normalize import fill_json, stdin_to_json
 from tracer import languages as _languages  # noqa: F401
 from tracer.registry import get_language
@@ -45,22 +45,19 @@ def _derived_paths(input_file):
     }
 
 
-def _instrument(input_file):
+def _instrument(input_file, output_file, code_bytes=None):
     ext = os.path.splitext(input_file)[1]
     lang = get_language(ext)
     if not lang:
         raise ValueError(f"Unsupported extension '{ext}'")
 
-    with open(input_file, "rb") as f:
-        code_bytes = f.read()
-
-    ts_parser = Parser()
-    ts_parser.language = lang.get_ts_language()
+    if code_bytes is None:
+        with open(input_file, "rb") as f:
+            code_bytes = f.read()
 
-    symbol_table = lang.analyze_types(ts_parser, code_bytes)
-    metadata = lang.collect_metadata(ts_parser, code_bytes, input_file)
-    code = lang.instrument(ts_parser, code_bytes, symbol_table, metadata)
-    return code, ext
+    with open(output_file, "wb") as f:
+        lang.process(lang.get_parser(), code_bytes, input_file, out=f)
+    return ext
 
 
 def _compile(src_path, exe_path):
@@ -89,35 +86,56 @@ def _normalize(raw_output, seed):
     return result.get("metadata", {}), result.get("traces", []), result.get("seed", -1)
 
 
-def deal(input, output=None, seed=None):
-    paths = _derived_paths(input)
-    
-    # If output path is specified, ensure it goes in the output folder
-    if output:
-        # If it's just a filename or relative path, put it in output folder
-        if not os.path.isabs(output):
-            input_dir = os.path.dirname(os.path.abspath(input))
-            output_dir = os.path.join(input_dir, "output")
-            output = os.path.join(output_dir, os.path.basename(output))
-    else:
-        # If no output specified, create default JSON name based on input file
-        basename = os.path.basename(input)
-        stem, ext = os.path.splitext(basename)
-        ext_no_dot = ext.lstrip('.')
-        input_dir = os.path.dirname(os.path.abspath(input))
-        output_dir = os.path.join(input_dir, "output")
-        output = os.path.join(output_dir, f"{stem}_{ext_no_dot}.json")
+def deal_to_dict(input, seed=None, scratch=False):
+    """Run the full pipeline on ``input`` and return the result dict.
+
+    This is what :func:`deal` writes out; callers that want the data in
+    memory use it directly instead of reading the JSON back.
+
+    By default the build artifacts and raw trace go to the output/ folder
+    next to ``input``. With ``scratch`` they go to a private scratch
+    directory instead, and the raw trace is not kept, so any number of
+    runs on the same file can overlap.
+    """
+    if not scratch:
+        return _pipeline(input, _derived_paths(input), seed)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        return _pipeline(input, _scratch_paths(tmpdir, os.path.basename(input)), seed)
+
+
+def deal_from_source(code_bytes, filename, seed=None):
+    """Run the full pipeline on in-memory source; return the result dict.
+
+    ``filename`` (its base name only) names the source and picks the
+    language. The compiler, interpreter and file metadata need a real
+    file, so the source is written once to a scratch directory that also
+    holds the build artifacts; no output/ folder or raw trace is kept.
+    """
+    name = os.path.basename(filename)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        src_path = os.path.join(tmpdir, name)
+        with open(src_path, "wb") as f:
+            f.write(code_bytes)
+        return _pipeline(src_path, _scratch_paths(tmpdir, name), seed, code_bytes)
+
+
+def _scratch_paths(tmpdir, name):
+    """Build artifact paths for source ``name`` inside ``tmpdir``; no raw trace."""
+    stem, ext = os.path.splitext(name)
+    return {
+        "instrumented": os.path.join(tmpdir, f"instrumented_{name}"),
+        "trace": None,
+        "exe": os.path.join(tmpdir, f"{stem}.exe"),
+        "ext": ext,
+    }
+
 
+def _pipeline(input, paths, seed, code_bytes=None):
     # ── Instrument ──────────────────────────────────────────────
     try:
-        code, ext = _instrument(input)
+        ext = _instrument(input, paths["instrumented"], code_bytes)
     except Exception as e:
-        result = _make_error("instrument", str(e))
-        _emit(result, output)
-        return 1
-
-    with open(paths["instrumented"], "w") as f:
-        f.write(code)
+        return _make_error("instrument", str(e))
 
     # ── Compile / Run ───────────────────────────────────────────
     is_python = ext == ".py"
@@ -128,52 +146,62 @@ def deal(input, output=None, seed=None):
         try:
             _compile(paths["instrumented"], paths["exe"])
         except subprocess.TimeoutExpired:
-            result = _make_error("compile", "Compilation timed out")
-            _emit(result, output)
-            return 1
+            return _make_error("compile", "Compilation timed out")
         except RuntimeError as e:
-            result = _make_error("compile", str(e))
-            _emit(result, output)
-            return 1
+            return _make_error("compile", str(e))
         cmd = [paths["exe"]]
 
     try:
         rc, stdout, stderr = _run(cmd)
     except subprocess.TimeoutExpired:
-        result = _make_error("runtime", "Program timed out (30s limit)")
-        _emit(result, output)
-        return 1
+        return _make_error("runtime", "Program timed out (30s limit)")
 
     # Save raw trace output
-    with open(paths["trace"], "w") as f:
-        f.write(stdout)
+    if paths["trace"]:
+        with open(paths["trace"], "w") as f:
+            f.write(stdout)
 
-    # ── Normalize ───────────────────────────────────────────────
     # ── Normalize ───────────────────────────────────────────────
     # Always try to normalize stdout, even if there was a runtime error
     try:
         metadata, traces, seed = _normalize(stdout, seed)
     except Exception as e:
         # If normalization fails, we can't do much with the traces
-        result = _make_error("normalize", f"Failed to parse trace output: {e}")
-        _emit(result, output)
-        return 1
+        return _make_error("normalize", f"Failed to parse trace output: {e}")
 
     if stderr or rc != 0:
         # Runtime error occurred, but we might have partial traces
         msg = stderr if stderr else f"Program exited with code {rc}"
-        result = _make_error(
+        return _make_error(
             "runtime",
             msg,
             metadata=metadata,
             traces=traces,
         )
-        _emit(result, output)
-        return 1
 
-    result = {"success": True, "metadata": metadata, "traces": traces, "seed": seed}
+    return {"success": True, "metadata": metadata, "traces": traces, "seed": seed}
+
+
+def deal(input, output=None, seed=None):
+    # If output path is specified, ensure it goes in the output folder
+    if output:
+        # If it's just a filename or relative path, put it in output folder
+        if not os.path.isabs(output):
+            input_dir = os.path.dirname(os.path.abspath(input))
+            output_dir = os.path.join(input_dir, "output")
+            output = os.path.join(output_dir, os.path.basename(output))
+    else:
+        # If no output specified, create default JSON name based on input file
+        basename = os.path.basename(input)
+        stem, ext = os.path.splitext(basename)
+        ext_no_dot = ext.lstrip('.')
+        input_dir = os.path.dirname(os.path.abspath(input))
+        output_dir = os.path.join(input_dir, "output")
+        output = os.path.join(output_dir, f"{stem}_{ext_no_dot}.json")
+
+    result = deal_to_dict(input, seed)
     _emit(result, output)
-    return 0
+    return 0 if result["success"] else 1
 
 
 def main():
@@ -229,16 +257,17 @@ def main():
 
 
 def _emit(data, output_path):
-    text = json.dumps(data, indent=2)
+    body = dumps(data, indent=True)
     if output_path:
         # Ensure output directory exists for the JSON output file
         output_dir = os.path.dirname(output_path)
         if output_dir:
             os.makedirs(output_dir, exist_ok=True)
-        with open(output_path, "w") as f:
-            f.write(text)
+        # One buffer, one write
+        with open(output_path, "wb") as f:
+            f.write(body)
     else:
-        print(text)
+        print(body.decode("utf-8"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,24 @@
+"""Optionally compile the C tracer backend with Cython.
+
+The tracer works unchanged as plain Python; this only builds an extension
+module next to ``tracer/languages/c.py`` that the import system picks up
+in its place.
+
+Usage (from the parser/ directory):
+    pip install cython setuptools
+    python setup_cython.py build_ext --inplace
+
+Delete the generated ``tracer/languages/c*.so`` (or ``.pyd``) to go back to
+the pure-Python module.
+"""
+
+from Cython.Build import cythonize
+from setuptools import setup
+
+setup(
+    name="parser-tracer-c",
+    ext_modules=cythonize(
+        ["tracer/languages/c.py"],
+        compiler_directives={"language_level": "3"},
+    ),
+)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The parser's modules (run, normalize, tracer) are imported top-level
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from tracer import cache as cache_module
+from tracer import languages  # noqa: F401
+from tracer.cache import InstrumentCache
+from tracer.registry import get_language
+
+# META traces, and so the file details, are emitted inside main()
+SOURCE = b"def main():\n    x = 2\n    y = x * 3\n\n\nmain()\n"
+
+
+@pytest.fixture
+def lang():
+    return get_language(".py")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = InstrumentCache(str(tmp_path / "instrument.db"))
+    yield cache
+    cache.close()
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "prog.py"
+    path.write_bytes(SOURCE)
+    return str(path)
+
+
+def _process(lang, code_bytes, source, cache):
+    return lang.process(lang.get_parser(), code_bytes, source, cache=cache)
+
+
+def _no_instrumenting(monkeypatch, lang):
+    def fail(*args, **kwargs):
+        raise AssertionError("cache hit expected, but the source was instrumented")
+
+    monkeypatch.setattr(lang, "instrument", fail)
+
+
+def test_hit_returns_stored_output_without_instrumenting(lang, cache, source, monkeypatch):
+    first = _process(lang, SOURCE, source, cache)
+    _no_instrumenting(monkeypatch, lang)
+    assert _process(lang, SOURCE, source, cache) == first
+
+
+def test_hit_survives_access_time_change(lang, cache, source, monkeypatch):
+    first = _process(lang, SOURCE, source, cache)
+    st = os.stat(source)
+    os.utime(source, ns=(st.st_atime_ns + 10**10, st.st_mtime_ns))
+    _no_instrumenting(monkeypatch, lang)
+    assert _process(lang, SOURCE, source, cache) == first
+
+
+def test_content_change_misses(lang, cache, source):
+    _process(lang, SOURCE, source, cache)
+    changed = SOURCE.replace(b"3", b"4")
+    with open(source, "wb") as f:
+        f.write(changed)
+    assert b"x * 4" in _process(lang, changed, source, cache)
+
+
+def test_mtime_change_misses(lang, cache, source):
+    first = _process(lang, SOURCE, source, cache)
+    st = os.stat(source)
+    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 10**10))
+    second = _process(lang, SOURCE, source, cache)
+    assert second != first
+    assert b"y = x * 3" in second
+
+
+def test_mode_change_misses(lang, cache, source):
+    first = _process(lang, SOURCE, source, cache)
+    os.chmod(source, 0o600)
+    second = _process(lang, SOURCE, source, cache)
+    assert second != first
+    assert b"-rw-------" in second
+
+
+def test_tracer_change_misses(lang, cache, source, monkeypatch):
+    _process(lang, SOURCE, source, cache)
+    monkeypatch.setattr(cache_module, "tracer_version", lambda: b"upgraded")
+    instrumented = []
+    original = lang.instrument
+
+    def instrument(*args, **kwargs):
+        instrumented.append(True)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(lang, "instrument", instrument)
+    _process(lang, SOURCE, source, cache)
+    assert instrumented
+
+
+def test_entries_persist_across_instances(lang, cache, source, tmp_path, monkeypatch):
+    first = _process(lang, SOURCE, source, cache)
+    reopened = InstrumentCache(cache.path)
+    try:
+        _no_instrumenting(monkeypatch, lang)
+        assert _process(lang, SOURCE, source, reopened) == first
+    finally:
+        reopened.close()
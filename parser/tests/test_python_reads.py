@@ -0,0 +1,31 @@
+from tracer import languages  # noqa: F401
+from tracer.registry import get_language
+
+
+def _instrument(tmp_path, source):
+    path = tmp_path / "prog.py"
+    path.write_text(source)
+    lang = get_language(".py")
+    return lang.process(lang.get_parser(), source.encode(), str(path)).decode()
+
+
+def _reads(output):
+    return [line.strip() for line in output.splitlines() if "print('READ'" in line]
+
+
+def test_repeated_name_is_read_once(tmp_path):
+    reads = _reads(_instrument(tmp_path, "x = 2\ny = x * x\n"))
+    assert reads == [
+        "print('READ', 'x', x, format(id(x), 'x'), '2', __tracer_depth, sep='\\0')"
+    ]
+
+
+def test_reads_keep_first_appearance_order(tmp_path):
+    reads = _reads(_instrument(tmp_path, "a = 1\nb = 2\nc = b + a + b\n"))
+    assert [r.split(", ")[1] for r in reads] == ["'b'", "'a'"]
+
+
+def test_call_attribute_and_keyword_names_are_not_reads(tmp_path):
+    source = "import math\nv = [3, 1]\nw = sorted(v, reverse=math.pi)\n"
+    reads = _reads(_instrument(tmp_path, source))
+    assert [r.split(", ")[1] for r in reads] == ["'v'", "'math'"]
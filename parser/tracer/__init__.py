@@ -1,11 +1,16 @@
 from .base import LanguageSupport
-from .core import SymbolTable, extract_var_name, get_text
+from .cache import InstrumentCache
+from .core import SymbolTable, extract_var_name, file_info, format_timestamp, get_ident, get_text
 from .registry import get_language, supported_extensions
 
 __all__ = [
+    "InstrumentCache",
     "LanguageSupport",
     "SymbolTable",
     "extract_var_name",
+    "file_info",
+    "format_timestamp",
+    "get_ident",
     "get_language",
     "get_text",
     "supported_extensions",
@@ -2,8 +2,7 @@ import argparse
 import os
 import sys
 
-from tree_sitter import Parser
-
+from .cache import InstrumentCache
 from .registry import get_language, supported_extensions
 
 # Import languages so they register themselves.
@@ -14,6 +13,13 @@ def main():
     ap = argparse.ArgumentParser(description="Instrument source code for tracing.")
     ap.add_argument("input_file", help="Path to the source file")
     ap.add_argument("-o", "--output", help="Path to the output file")
+    ap.add_argument(
+        "--cache",
+        nargs="?",
+        const="",
+        metavar="DB",
+        help="Reuse results for unchanged files (default DB: ~/.cache/spiral/instrument.db)",
+    )
     args = ap.parse_args()
 
     if not os.path.exists(args.input_file):
@@ -30,16 +36,11 @@ def main():
     with open(args.input_file, "rb") as f:
         code_bytes = f.read()
 
-    ts_parser = Parser()
-    ts_parser.language = lang.get_ts_language()
-
-    symbol_table = lang.analyze_types(ts_parser, code_bytes)
-    metadata = lang.collect_metadata(ts_parser, code_bytes, args.input_file)
-    result = lang.instrument(ts_parser, code_bytes, symbol_table, metadata)
+    cache = InstrumentCache(args.cache or None) if args.cache is not None else None
 
     output_path = args.output or "instrumented_" + os.path.basename(args.input_file)
-    with open(output_path, "w") as f:
-        f.write(result)
+    with open(output_path, "wb") as f:
+        lang.process(lang.get_parser(), code_bytes, args.input_file, out=f, cache=cache)
 
     print(f"Instrumented code written to {output_path}")
 
@@ -1,5 +1,9 @@
+import threading
 from abc import ABC, abstractmethod
 
+from tree_sitter import Parser
+
+from .cache import cache_key
 from .core import SymbolTable
 
 
@@ -16,18 +20,70 @@ class LanguageSupport(ABC):
     name: str
     extensions: frozenset[str]
 
+    def __init__(self):
+        # Backends are registry singletons; parsers are not thread-safe,
+        # so each thread gets its own, created on first use.
+        self._local = threading.local()
+
     @abstractmethod
     def get_ts_language(self):
         """Return the tree-sitter ``Language`` object."""
 
+    def get_parser(self) -> Parser:
+        """Return this thread's ``Parser`` for the language, reused across files."""
+        parser = getattr(self._local, "parser", None)
+        if parser is None:
+            parser = self._local.parser = Parser(self.get_ts_language())
+        return parser
+
+    # Each phase takes an optional, already-parsed ``tree`` of
+    # ``code_bytes``; without one it parses the source itself.
+
     @abstractmethod
-    def analyze_types(self, ts_parser, code_bytes) -> SymbolTable:
+    def analyze_types(self, ts_parser, code_bytes, tree=None) -> SymbolTable:
         """Walk the AST and build a symbol table of variable types."""
 
     @abstractmethod
-    def collect_metadata(self, ts_parser, code_bytes, source_file) -> dict:
+    def collect_metadata(self, ts_parser, code_bytes, source_file, tree=None) -> dict:
         """Return a dict of metadata about the source file."""
 
     @abstractmethod
-    def instrument(self, ts_parser, code_bytes, symbol_table, metadata) -> str:
-        """Return the instrumented source code as a string."""
+    def instrument(
+        self, ts_parser, code_bytes, symbol_table, metadata, out=None, tree=None
+    ) -> bytes | None:
+        """Return the instrumented source code as UTF-8 bytes.
+
+        If ``out`` (a binary file object) is given, write the code to it
+        instead and return ``None``.
+        """
+
+    def process(
+        self, ts_parser, code_bytes, source_file, out=None, cache=None
+    ) -> bytes | None:
+        """Analyze, collect metadata for, and instrument one source file.
+
+        Returns (or writes to ``out``) what :meth:`instrument` does. The
+        source is parsed once and the tree shared by all three phases,
+        which only read it.
+
+        With a :class:`~tracer.cache.InstrumentCache` as ``cache``, a file
+        seen before with the same content and file details is served from
+        the cache without being parsed.
+        """
+        if cache is not None:
+            key = cache_key(self.name, code_bytes, source_file)
+            code = cache.get(key)
+            if code is None:
+                code = self.process(ts_parser, code_bytes, source_file)
+                cache.put(key, code)
+            if out is None:
+                return code
+            out.write(code)
+            return None
+
+        tree = ts_parser.parse(code_bytes)
+        symbol_table = self.analyze_types(ts_parser, code_bytes, tree)
+        metadata = self.collect_metadata(ts_parser, code_bytes, source_file, tree)
+        return self.instrument(
+            ts_parser, code_bytes, symbol_table, metadata, out=out, tree=tree
+        )
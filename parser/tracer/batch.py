@@ -0,0 +1,154 @@
+"""Instrument many source files in parallel.
+
+Usage:
+    python -m tracer.batch <file_or_dir>... [-o OUTPUT_DIR] [-j JOBS]
+
+Directories are scanned (non-recursively) for files with a supported
+extension. Each worker process keeps its own parser per language, and with
+``--cache`` its own connection to the shared instrument cache.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+from multiprocessing import Pool
+
+from .cache import InstrumentCache, cache_key
+from .registry import get_language, supported_extensions
+
+# Import languages so they register themselves.
+from . import languages  # noqa: F401
+
+
+# Per-process cache connections, opened on first use by path
+_caches: dict[str, InstrumentCache] = {}
+
+
+def _get_cache(path):
+    cache = _caches.get(path)
+    if cache is None:
+        cache = _caches[path] = InstrumentCache(path or None)
+    return cache
+
+
+def instrument_file(input_file, output_file, cache_path=None):
+    """Instrument ``input_file`` into ``output_file``; return an error or None.
+
+    ``cache_path`` enables the instrument cache ("" for the default DB).
+    """
+    ext = os.path.splitext(input_file)[1]
+    lang = get_language(ext)
+    if not lang:
+        return f"unsupported extension '{ext}'"
+    try:
+        with open(input_file, "rb") as f:
+            code_bytes = f.read()
+        cache = _get_cache(cache_path) if cache_path is not None else None
+        with open(output_file, "wb") as f:
+            lang.process(lang.get_parser(), code_bytes, input_file, out=f, cache=cache)
+    except Exception as e:
+        return str(e)
+    return None
+
+
+def _run_job(job):
+    input_file, output_file, cache_path = job
+    return input_file, instrument_file(input_file, output_file, cache_path)
+
+
+def _write_cached(input_file, output_file, cache):
+    """Write ``input_file``'s cached instrumentation, if there is one.
+
+    Returns whether it did; anything unexpected is left for a worker to
+    run (and report) normally.
+    """
+    lang = get_language(os.path.splitext(input_file)[1])
+    if not lang:
+        return False
+    try:
+        with open(input_file, "rb") as f:
+            code_bytes = f.read()
+        code = cache.get(cache_key(lang.name, code_bytes, input_file))
+        if code is None:
+            return False
+        with open(output_file, "wb") as f:
+            f.write(code)
+    except (OSError, sqlite3.Error):
+        return False
+    return True
+
+
+def instrument_many(jobs, processes=None, cache_path=None):
+    """Instrument ``(input_file, output_file)`` pairs across a process pool.
+
+    Yields ``(input_file, error_or_None)`` as each file finishes, in
+    completion order. With ``cache_path``, cache hits are written out
+    up front and only the misses are sent to workers.
+    """
+    jobs = list(jobs)
+    if cache_path is not None and jobs:
+        # A private connection, closed before the pool forks
+        cache = InstrumentCache(cache_path or None)
+        misses = []
+        try:
+            for input_file, output_file in jobs:
+                if _write_cached(input_file, output_file, cache):
+                    yield input_file, None
+                else:
+                    misses.append((input_file, output_file))
+        finally:
+            cache.close()
+        jobs = misses
+    jobs = [(src, dst, cache_path) for src, dst in jobs]
+    if processes == 1 or len(jobs) <= 1:
+        yield from map(_run_job, jobs)
+        return
+    with Pool(processes) as pool:
+        yield from pool.imap_unordered(_run_job, jobs)
+
+
+def _collect_inputs(paths):
+    exts = supported_extensions()
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                full = os.path.join(path, name)
+                if os.path.splitext(name)[1] in exts and os.path.isfile(full):
+                    yield full
+        else:
+            yield path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Instrument many source files in parallel.")
+    ap.add_argument("inputs", nargs="+", help="Source files and/or directories")
+    ap.add_argument("-o", "--output-dir", default=".", help="Directory for instrumented files")
+    ap.add_argument("-j", "--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    ap.add_argument(
+        "--cache",
+        nargs="?",
+        const="",
+        metavar="DB",
+        help="Reuse results for unchanged files (default DB: ~/.cache/spiral/instrument.db)",
+    )
+    args = ap.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [
+        (path, os.path.join(args.output_dir, "instrumented_" + os.path.basename(path)))
+        for path in _collect_inputs(args.inputs)
+    ]
+
+    failed = 0
+    for input_file, error in instrument_many(jobs, args.jobs, args.cache):
+        if error:
+            failed += 1
+            print(f"Error: {input_file}: {error}")
+        else:
+            print(f"Instrumented {input_file}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
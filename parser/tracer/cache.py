@@ -0,0 +1,99 @@
+"""Persistent cache of instrumented output, keyed by source content.
+
+Instrumenting re-parses and re-walks a file even when nothing about it has
+changed. :class:`InstrumentCache` stores each result in a small SQLite
+database so a repeat run can return it straight away.
+
+The key covers the language, a hash of the source bytes, and the file's
+path, size, mode and modification time, all of which the output reports.
+It also covers a hash of the tracer's own sources and the tree-sitter
+versions, so upgrading either starts from an empty cache. Access and
+change times are left out: reading the source to instrument it can move
+them, which would make every entry miss. A cached result therefore
+reports the access and creation times from when it was first produced.
+"""
+
+import functools
+import hashlib
+import os
+import sqlite3
+from importlib import metadata
+
+# Parser distributions whose trees the instrumentation is built on
+_PARSER_DISTRIBUTIONS = ("tree-sitter", "tree-sitter-c", "tree-sitter-python")
+
+
+def default_cache_path() -> str:
+    """Return ``$XDG_CACHE_HOME/spiral/instrument.db`` (``~/.cache`` by default)."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "spiral", "instrument.db")
+
+
+@functools.lru_cache(maxsize=None)
+def tracer_version() -> bytes:
+    """Digest of the tracer package's sources and the parser versions."""
+    h = hashlib.blake2b(digest_size=16)
+    package = os.path.dirname(os.path.abspath(__file__))
+    for root, dirs, files in os.walk(package):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, package).encode("utf-8") + b"\0")
+                with open(path, "rb") as f:
+                    h.update(f.read())
+    for dist in _PARSER_DISTRIBUTIONS:
+        try:
+            version = metadata.version(dist)
+        except metadata.PackageNotFoundError:
+            version = ""
+        h.update(f"\0{dist}={version}".encode("utf-8"))
+    return h.digest()
+
+
+def cache_key(language: str, code_bytes: bytes, source_file: str) -> bytes:
+    """Digest identifying one instrumentation of ``source_file``."""
+    h = hashlib.blake2b(code_bytes, digest_size=16)
+    h.update(b"\0" + tracer_version())
+    h.update(b"\0" + language.encode("utf-8"))
+    st = os.stat(source_file)
+    for value in (
+        os.path.abspath(source_file), st.st_size, st.st_mode, st.st_mtime_ns
+    ):
+        h.update(b"\0" + str(value).encode("utf-8"))
+    return h.digest()
+
+
+class InstrumentCache:
+    """SQLite-backed map from :func:`cache_key` digests to instrumented code.
+
+    A connection belongs to the thread (and process) that opened it, so
+    give each worker its own instance.
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path or default_cache_path()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS instrumented (key BLOB PRIMARY KEY, code BLOB)"
+        )
+        self._conn.commit()
+
+    def get(self, key: bytes) -> bytes | None:
+        row = self._conn.execute(
+            "SELECT code FROM instrumented WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: bytes, code: bytes) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO instrumented (key, code) VALUES (?, ?)",
+            (key, code),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
@@ -1,25 +1,106 @@
+import functools
+import math
+import os
+import stat
+import sys
+import time
+
+
+@functools.lru_cache(maxsize=256)
+def _format_second(second: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+
+
+def format_timestamp(t: float) -> str:
+    """Format a POSIX timestamp as local ``YYYY-MM-DD HH:MM:SS``.
+
+    Formatting is memoized per whole second; a file's three timestamps
+    (and a batch of files touched together) often share one.
+    """
+    return _format_second(math.floor(t))
+
+
+def file_info(source_file: str) -> dict:
+    """Return the file-level metadata fields every backend reports."""
+    st = os.stat(source_file)
+    return {
+        "file_name": os.path.basename(source_file).replace("\\", "/"),
+        "file_path": os.path.abspath(source_file).replace("\\", "/"),
+        "file_size": st.st_size,
+        "file_mode": stat.filemode(st.st_mode),
+        "modified": format_timestamp(st.st_mtime),
+        "accessed": format_timestamp(st.st_atime),
+        "created": format_timestamp(st.st_ctime),
+    }
+
+
 class SymbolTable:
     """Language-agnostic variable → type mapping."""
 
     def __init__(self):
         self.var_types: dict[str, str] = {}
+        # Full type of each individual declaration, keyed by the start byte
+        # of its declarator, so names reused with different types resolve
+        # to the right one.
+        self.decl_types: dict[int, str] = {}
+        # Optional output format for each variable/declaration, for
+        # backends that derive one from the type (e.g. a printf specifier)
+        self.var_fmts: dict[str, str] = {}
+        self.decl_fmts: dict[int, str] = {}
 
-    def register(self, var_name: str, var_type: str):
+    def register(
+        self,
+        var_name: str,
+        var_type: str,
+        decl_site: int | None = None,
+        fmt: str | None = None,
+    ):
         self.var_types[var_name] = var_type
+        if decl_site is not None:
+            self.decl_types[decl_site] = var_type
+        if fmt is not None:
+            self.var_fmts[var_name] = fmt
+            if decl_site is not None:
+                self.decl_fmts[decl_site] = fmt
 
     def get_type(self, var_name: str, default: str | None = None) -> str | None:
         return self.var_types.get(var_name, default)
 
+    def get_decl_type(self, decl_site: int, default: str | None = None) -> str | None:
+        return self.decl_types.get(decl_site, default)
+
+    def get_fmt(self, var_name: str, default: str | None = None) -> str | None:
+        return self.var_fmts.get(var_name, default)
+
+    def get_decl_fmt(self, decl_site: int, default: str | None = None) -> str | None:
+        return self.decl_fmts.get(decl_site, default)
+
 
 def get_text(node, code_bytes: bytes) -> str:
     """Extract source text for a tree-sitter node."""
     return code_bytes[node.start_byte : node.end_byte].decode("utf-8")
 
 
+@functools.lru_cache(maxsize=4096)
+def _decode_ident(raw: bytes) -> str:
+    return sys.intern(raw.decode("utf-8"))
+
+
+def get_ident(node, code_bytes: bytes) -> str:
+    """Extract an identifier's text as an interned string.
+
+    Names are looked up in sets and dicts over and over while
+    instrumenting; interning makes repeated occurrences share one object.
+    Decoding is cached on the raw bytes, so each distinct name is decoded
+    once no matter how many times it appears.
+    """
+    return _decode_ident(code_bytes[node.start_byte : node.end_byte])
+
+
 def extract_var_name(node, code_bytes: bytes) -> str | None:
     """Extract variable name from various declarator types."""
     if node.type == "identifier":
-        return get_text(node, code_bytes)
+        return get_ident(node, code_bytes)
     elif node.type == "pointer_declarator":
         for child in node.children:
             if child.type != "*":
@@ -27,7 +108,7 @@ def extract_var_name(node, code_bytes: bytes) -> str | None:
     elif node.type == "array_declarator":
         for child in node.children:
             if child.type == "identifier":
-                return get_text(child, code_bytes)
+                return get_ident(child, code_bytes)
             elif child.type in ("pointer_declarator", "array_declarator"):
                 return extract_var_name(child, code_bytes)
     # Fallback: recursively search for identifier
@@ -1,15 +1,16 @@
-import os
-import stat
-import time
+import functools
+import operator
+import re
+import sys
 
-from tree_sitter import Language
+from tree_sitter import Language, Parser
 from tree_sitter_c import language
 
 from ..base import LanguageSupport
-from ..core import SymbolTable, extract_var_name, get_text
+from ..core import SymbolTable, extract_var_name, file_info, get_ident, get_text
 from ..registry import register
 
-KEYWORDS = {
+KEYWORDS = frozenset(map(sys.intern, {
     "printf",
     "main",
     "return",
@@ -28,7 +29,85 @@ KEYWORDS = {
     "union",
     "goto",
     "do",
-}
+}))
+# Same names as raw source bytes, for testing identifiers before decoding
+_KEYWORD_BYTES = frozenset(k.encode("utf-8") for k in KEYWORDS)
+
+# The Language wrapper is built once at import; parsers are cheap to make
+# from it and every C file shares the same grammar.
+C_LANGUAGE = Language(language())
+
+
+def new_c_parser() -> Parser:
+    """Return a fresh ``Parser`` already bound to :data:`C_LANGUAGE`."""
+    return Parser(C_LANGUAGE)
+
+
+# Traversals compare ``node.kind_id`` (a small int) rather than
+# ``node.type``, which builds a new str for every node it is read on.
+
+
+def _kind_ids(*names: str) -> frozenset[int]:
+    """Every kind_id the C grammar reports under one of ``names``.
+
+    Some node types (``call_expression``, ``function_definition``, ...)
+    exist under more than one symbol id, so ``id_for_node_kind`` alone
+    would miss nodes.
+    """
+    wanted = frozenset(names)
+    return frozenset(
+        kind_id
+        for kind_id in range(C_LANGUAGE.node_kind_count)
+        if C_LANGUAGE.node_kind_for_id(kind_id) in wanted
+    )
+
+
+def _by_kind_id(table: dict) -> dict:
+    """Re-key a ``{node type: value}`` table by kind_id."""
+    return {
+        kind_id: value
+        for name, value in table.items()
+        for kind_id in _kind_ids(name)
+    }
+
+
+_IDENTIFIER_KINDS = _kind_ids("identifier")
+_FUNCTION_DEFINITION_KINDS = _kind_ids("function_definition")
+_DECLARATION_KINDS = _kind_ids("declaration")
+_PARAMETER_DECLARATION_KINDS = _kind_ids("parameter_declaration")
+_LOOP_KINDS = _kind_ids("while_statement", "for_statement", "do_statement")
+_BRANCH_KINDS = _kind_ids("if_statement", "switch_statement")
+_RETURN_KINDS = _kind_ids("return_statement")
+_ASSIGNMENT_KINDS = _kind_ids("assignment_expression", "update_expression")
+_CALL_KINDS = _kind_ids("call_expression")
+_COMMENT_KINDS = _kind_ids("comment")
+_PREPROC_INCLUDE_KINDS = _kind_ids("preproc_include")
+_COMPOUND_STATEMENT_KINDS = _kind_ids("compound_statement")
+
+
+# Fragments of the code inserted into the instrumented program. Each
+# inserted line carries the newline that separates it from the line before.
+_PRINTF_OPEN = b'\n    printf("'
+_PRINTF_ARGS = b'\\n", '
+_PRINTF_NO_ARGS = b'\\n"'
+_PRINTF_CLOSE = b");"
+_SETBUF = b"\n    setbuf(stdout, NULL);"
+_DEPTH_INC = b"\n    __stack_depth++;"
+_DEPTH_DEC = b"\n    __stack_depth--;"
+
+# Whole printf() calls for the most frequent trace shapes, filled in with
+# bytes %-formatting (so the printf specifiers themselves are written %%).
+# Constant fields sit in the format string itself; only the NUL separators
+# and runtime values are passed as arguments.
+# DECL/READ/ASSIGN/RETURN: tag, var, value, &var, line, depth
+_TRACE_VAR = (
+    b'\n    printf("%s%%c%s%%c%s%%c%%p%%c%d%%c%%d\\n", 0, 0, %s, 0, &%s, 0, 0, '
+    b"__stack_depth);"
+)
+# BRANCH: kind, condition, line, depth
+_TRACE_BRANCH = (
+    b'\n    printf("BRANCH%%c%s%%c%s%%c%d%%c%%d\\n", 0, 0, 0, 0, __stack_depth);'
+)
 
 TYPE_FMT = {
     "int": "%d",
@@ -56,6 +135,12 @@ def _type_fmt(type_name: str) -> str:
     return "%d"
 
 
+@functools.lru_cache(maxsize=1024)
+def _escape(raw: str) -> str:
+    """Escape source text for use inside a printf string literal."""
+    return raw.replace("%", "%%").replace('"', '\\"')
+
+
 def _extract_condition(node, code_bytes: bytes):
     condition = node.child_by_field_name("condition")
     if not condition:
@@ -63,8 +148,83 @@ def _extract_condition(node, code_bytes: bytes):
     raw = get_text(condition, code_bytes)
     cond_expr = raw
     cond_text = raw[1:-1] if raw.startswith("(") and raw.endswith(")") else raw
-    cond_text = cond_text.replace("%", "%%").replace('"', '\\"')
-    return cond_text, cond_expr
+    return _escape(cond_text), cond_expr
+
+
+def _line_starts(text: bytes) -> list[int]:
+    """Return the byte offset at which each line of ``text`` starts.
+
+    Rows are counted on ``\n`` like tree-sitter does, so indices line up
+    with ``node.start_point[0]``. A trailing newline does not open a
+    further (empty) line.
+    """
+    starts = [0] if text else []
+    size = len(text)
+    pos = text.find(b"\n")
+    while pos != -1:
+        if pos + 1 < size:
+            starts.append(pos + 1)
+        pos = text.find(b"\n", pos + 1)
+    return starts
+
+
+# Subtrees the instrumenter never needs to enter: nothing inside them is
+# executed as a statement (or evaluated at all, for sizeof)
+_PRUNED_KINDS = _kind_ids(
+    "preproc_include",
+    "preproc_def",
+    "struct_specifier",
+    "enum_specifier",
+    "union_specifier",
+    "type_definition",
+    "sizeof_expression",
+    "string_literal",
+)
+
+# Expression subtrees hold no declarations (short of GNU statement
+# expressions), so the type pass does not descend into them
+_EXPRESSION_KINDS = _kind_ids(
+    "assignment_expression",
+    "binary_expression",
+    "call_expression",
+    "cast_expression",
+    "comma_expression",
+    "compound_literal_expression",
+    "conditional_expression",
+    "field_expression",
+    "initializer_list",
+    "parenthesized_expression",
+    "pointer_expression",
+    "sizeof_expression",
+    "subscript_expression",
+    "unary_expression",
+    "update_expression",
+    "concatenated_string",
+    "string_literal",
+    "char_literal",
+)
+
+# A line holding at least one non-whitespace byte
+_NON_BLANK_LINE = re.compile(rb"^[^\S\n]*\S", re.MULTILINE)
+
+# Insertions sort on their slot alone: 2 * line for code going before the
+# line, 2 * line + 1 for code going after it. list.sort is stable, so
+# insertions sharing a slot keep the order they were added in.
+_EDIT_ORDER = operator.itemgetter(0)
+
+
+def _extract_function_name(func_def_node, code_bytes: bytes):
+    """Extract function name from function_definition, handling pointer returns."""
+    stack = func_def_node.children[::-1]
+    while stack:
+        node = stack.pop()
+        if node.type == "function_declarator":
+            for child in node.children:
+                if child.type == "identifier":
+                    return get_ident(child, code_bytes)
+        elif node.type == "pointer_declarator":
+            stack.extend(reversed(node.children))
+    return None
 
 
 # ── Type analysis ────────────────────────────────────────────────────
@@ -75,19 +235,33 @@ class CTypeAnalyzer:
         self.ts_parser = ts_parser
         self.code_bytes = code_bytes
         self.symbol_table = SymbolTable()
-
-    def analyze(self) -> SymbolTable:
-        tree = self.ts_parser.parse(self.code_bytes)
+        # type string -> printf format; a file repeats a handful of types
+        self._fmt_cache: dict[str, str] = {}
+        self._handlers = _by_kind_id({
+            "declaration": self._handle_declaration,
+            "parameter_declaration": self._handle_parameter,
+        })
+
+    def analyze(self, tree=None) -> SymbolTable:
+        if tree is None:
+            tree = self.ts_parser.parse(self.code_bytes)
         self._collect(tree.root_node)
         return self.symbol_table
 
-    def _collect(self, node):
-        if node.type == "declaration":
-            self._handle_declaration(node)
-        elif node.type == "parameter_declaration":
-            self._handle_parameter(node)
-        for child in node.children:
-            self._collect(child)
+    def _collect(self, root):
+        handlers = self._handlers
+        cursor = root.walk()
+        while True:
+            node = cursor.node
+            kind = node.kind_id
+            handler = handlers.get(kind)
+            if handler:
+                handler(node)
+            if kind not in _EXPRESSION_KINDS and cursor.goto_first_child():
+                continue
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return
 
     def _handle_declaration(self, node):
         type_node = node.child_by_field_name("type")
@@ -100,7 +274,7 @@ class CTypeAnalyzer:
                     type_node = child
                     break
 
-        cur_type = get_text(type_node, self.code_bytes) if type_node else "int"
+        cur_type = get_ident(type_node, self.code_bytes) if type_node else "int"
 
         for child in node.children:
             if child.type == "init_declarator":
@@ -109,9 +283,24 @@ class CTypeAnalyzer:
                     var_name = extract_var_name(var_node, self.code_bytes)
                     full_type = self._build_type(cur_type, var_node)
                     if var_name:
-                        self.symbol_table.register(var_name, full_type)
+                        self.symbol_table.register(
+                            var_name,
+                            full_type,
+                            var_node.start_byte,
+                            self._fmt(full_type),
+                        )
             elif child.type == "identifier":
-                self.symbol_table.register(get_text(child, self.code_bytes), cur_type)
+                self.symbol_table.register(
+                    get_ident(child, self.code_bytes),
+                    cur_type,
+                    fmt=self._fmt(cur_type),
+                )
+
+    def _fmt(self, type_name):
+        fmt = self._fmt_cache.get(type_name)
+        if fmt is None:
+            fmt = self._fmt_cache[type_name] = _type_fmt(type_name)
+        return fmt
 
     def _build_type(self, base_type, declarator):
         """Build full type including pointer/array modifiers."""
@@ -123,13 +312,15 @@ class CTypeAnalyzer:
 
     def _handle_parameter(self, node):
         type_node = node.child_by_field_name("type")
-        cur_type = get_text(type_node, self.code_bytes) if type_node else "int"
+        cur_type = get_ident(type_node, self.code_bytes) if type_node else "int"
         var_node = node.child_by_field_name("declarator")
         if var_node:
             var_name = extract_var_name(var_node, self.code_bytes)
             full_type = self._build_type(cur_type, var_node)
             if var_name:
-                self.symbol_table.register(var_name, full_type)
+                self.symbol_table.register(
+                    var_name, full_type, var_node.start_byte, self._fmt(full_type)
+                )
 
 
 # ── Metadata collection ─────────────────────────────────────────────
@@ -154,31 +345,18 @@ class CMetadataCollector:
         self.includes: list[str] = []
         self.defined_functions: set[str] = set()
 
-    def collect(self) -> dict:
-        code_text = self.code_bytes.decode("utf-8")
-        tree = self.ts_parser.parse(self.code_bytes)
-        self._extract_includes(tree.root_node)
-        self._walk(tree.root_node, depth=0)
-        self._count_comments(tree.root_node)
+    def collect(self, tree=None) -> dict:
+        if tree is None:
+            tree = self.ts_parser.parse(self.code_bytes)
+        self._walk(tree.root_node)
 
-        for line in code_text.splitlines():
-            if line.strip().startswith("#include"):
-                self.num_includes += 1
-
-        st = os.stat(self.source_file)
-        total_lines = code_text.count("\n") + 1
+        total_lines = self.code_bytes.count(b"\n") + 1
 
         return {
-            "file_name": os.path.basename(self.source_file).replace("\\", "/"),
-            "file_path": os.path.abspath(self.source_file).replace("\\", "/"),
-            "file_size": st.st_size,
-            "file_mode": stat.filemode(st.st_mode),
-            "modified": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_mtime)),
-            "accessed": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_atime)),
-            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_ctime)),
+            **file_info(self.source_file),
             "language": "C",
             "total_lines": total_lines,
-            "non_blank_lines": sum(1 for ln in code_text.splitlines() if ln.strip()),
+            "non_blank_lines": len(_NON_BLANK_LINE.findall(self.code_bytes)),
             "num_includes": self.num_includes,
             "num_comments": self.num_comments,
             "num_functions": self.num_functions,
@@ -194,81 +372,91 @@ class CMetadataCollector:
             "defined_functions": ",".join(sorted(self.defined_functions)),
         }
 
-    def _extract_includes(self, node):
-        """Walk the AST and extract include file names."""
-        if node.type == "preproc_include":
-            # Extract the path from #include directive
-            for child in node.children:
-                if child.type == "string_literal" or child.type == "system_lib_string":
-                    include_path = get_text(child, self.code_bytes).strip('"<>')
-                    self.includes.append(include_path)
-        for child in node.children:
-            self._extract_includes(child)
-
-    def _count_comments(self, node):
-        for child in node.children:
-            if child.type == "comment":
-                self.num_comments += 1
-            self._count_comments(child)
-
-    def _extract_function_name(self, func_def_node):
-        """Extract function name from function_definition, handling pointer returns."""
-        def find_func_declarator(node):
-            if node.type == "function_declarator":
+    def _walk(self, root):
+        """Gather every counter in one pre-order pass over the tree.
+
+        Uses a ``TreeCursor`` rather than recursion; ``depth`` tracks how
+        many ``compound_statement`` nodes enclose the cursor. Counters are
+        kept in locals for the duration of the loop and stored at the end.
+        """
+        code_bytes = self.code_bytes
+        function_names = self.function_names
+        defined_functions = self.defined_functions
+        includes = self.includes
+        num_functions = num_variables = num_loops = num_branches = 0
+        num_returns = num_assignments = num_calls = 0
+        num_comments = num_includes = 0
+        max_depth = self.max_depth
+
+        cursor = root.walk()
+        depth = 0
+        done = False
+        while not done:
+            node = cursor.node
+            kind = node.kind_id
+            if kind in _FUNCTION_DEFINITION_KINDS:
+                num_functions += 1
+                func_name = _extract_function_name(node, code_bytes)
+                if func_name:
+                    function_names.append(func_name)
+                    defined_functions.add(func_name)
+            elif kind in _DECLARATION_KINDS:
                 for child in node.children:
-                    if child.type == "identifier":
-                        return get_text(child, self.code_bytes)
-            elif node.type == "pointer_declarator":
+                    if child.type == "init_declarator":
+                        num_variables += 1
+            elif kind in _PARAMETER_DECLARATION_KINDS:
+                num_variables += 1
+            elif kind in _LOOP_KINDS:
+                num_loops += 1
+            elif kind in _BRANCH_KINDS:
+                num_branches += 1
+            elif kind in _RETURN_KINDS:
+                num_returns += 1
+            elif kind in _ASSIGNMENT_KINDS:
+                num_assignments += 1
+            elif kind in _CALL_KINDS:
+                num_calls += 1
+            elif kind in _COMMENT_KINDS:
+                num_comments += 1
+            elif kind in _PREPROC_INCLUDE_KINDS:
+                num_includes += 1
                 for child in node.children:
-                    result = find_func_declarator(child)
-                    if result:
-                        return result
-            return None
-        
-        for child in func_def_node.children:
-            result = find_func_declarator(child)
-            if result:
-                return result
-        return None
-
-    def _walk(self, node, depth):
-        if node.type == "function_definition":
-            self.num_functions += 1
-            func_name = self._extract_function_name(node)
-            if func_name:
-                self.function_names.append(func_name)
-                self.defined_functions.add(func_name)
-        elif node.type == "declaration":
-            for child in node.children:
-                if child.type == "init_declarator":
-                    self.num_variables += 1
-        elif node.type == "parameter_declaration":
-            self.num_variables += 1
-        elif node.type in ("while_statement", "for_statement", "do_statement"):
-            self.num_loops += 1
-        elif node.type in ("if_statement", "switch_statement"):
-            self.num_branches += 1
-        elif node.type == "return_statement":
-            self.num_returns += 1
-        elif node.type in ("assignment_expression", "update_expression"):
-            self.num_assignments += 1
-        elif node.type == "call_expression":
-            self.num_calls += 1
-
-        if node.type == "compound_statement":
-            depth += 1
-            if depth > self.max_depth:
-                self.max_depth = depth
+                    if child.type in ("string_literal", "system_lib_string"):
+                        include_path = get_text(child, code_bytes).strip('"<>')
+                        includes.append(include_path)
+            elif kind in _COMPOUND_STATEMENT_KINDS:
+                depth += 1
+                if depth > max_depth:
+                    max_depth = depth
+
+            if cursor.goto_first_child():
+                continue
+            if kind in _COMPOUND_STATEMENT_KINDS:
+                depth -= 1
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    done = True
+                    break
+                if cursor.node.kind_id in _COMPOUND_STATEMENT_KINDS:
+                    depth -= 1
 
-        for child in node.children:
-            self._walk(child, depth)
+        self.num_functions += num_functions
+        self.num_variables += num_variables
+        self.num_loops += num_loops
+        self.num_branches += num_branches
+        self.num_returns += num_returns
+        self.num_assignments += num_assignments
+        self.num_calls += num_calls
+        self.num_comments += num_comments
+        self.num_includes += num_includes
+        self.max_depth = max_depth
 
 
 # ── Code instrumentation ────────────────────────────────────────────
 
 
 class CInstrumenter:
-    EXCLUDE_TYPES = {
+    EXCLUDE_TYPES = frozenset({
         "declaration",
         "init_declarator",
         "function_declarator",
@@ -276,146 +464,293 @@ class CInstrumenter:
         "parameter_declaration",
         "function_definition",
         "update_expression",
-    }
+    })
+    _EXCLUDE_KINDS = _kind_ids(*EXCLUDE_TYPES)
 
     def __init__(self, ts_parser, code_bytes, symbol_table, metadata=None):
         self.ts_parser = ts_parser
         self.code_bytes = code_bytes
         self.symbol_table = symbol_table
         self.metadata = metadata or {}
-        self.lines = code_bytes.decode("utf-8").splitlines()
-        self.insertions: dict[int, list[str]] = {}
-        self.pre_insertions: dict[int, list[str]] = {}
+        # Output drops carriage returns at line ends, so work on LF-only text
+        self.text = (
+            code_bytes.replace(b"\r\n", b"\n") if b"\r" in code_bytes else code_bytes
+        )
+        self.line_starts = _line_starts(self.text)
+        # (slot, code) in the order they were added; see _EDIT_ORDER
+        self.edits: list[tuple[int, bytes]] = []
         self.branch_counter = 0
-        # Parse defined functions from metadata
-        self.defined_functions = set()
+        # Number of function_definition nodes enclosing the traversal
+        self._function_depth = 0
+        # Parse defined functions from metadata; kept as bytes so call sites
+        # can be tested against the raw source slice without decoding
+        self.defined_functions: frozenset[bytes] = frozenset()
         if metadata and "defined_functions" in metadata:
             func_str = metadata["defined_functions"]
             if func_str:
-                self.defined_functions = set(func_str.split(","))
-        # Track declared variables to prevent reading before declaration
-        self.declared_vars: set[str] = set()
-        self.local_var_types: dict[str, str] = {}
-    def instrument(self) -> str:
-        tree = self.ts_parser.parse(self.code_bytes)
+                self.defined_functions = frozenset(
+                    f.encode("utf-8") for f in func_str.split(",")
+                )
+        # Track declared variables (as raw bytes) to prevent reading
+        # before declaration
+        self.declared_vars: set[bytes] = set()
+        # printf format per variable in scope; declarations and parameters
+        # overwrite the file-wide entry with the format of their own site
+        self._var_fmt: dict[str, str] = {}
+        # node type -> bound visitor, built once instead of per node
+        self._dispatch = _by_kind_id({
+            "function_definition": self._visit_function_definition,
+            "parameter_declaration": self._visit_parameter_declaration,
+            "if_statement": self._visit_if_statement,
+            "while_statement": self._visit_while_statement,
+            "for_statement": self._visit_for_statement,
+            "do_statement": self._visit_do_statement,
+            "switch_statement": self._visit_switch_statement,
+            "case_statement": self._visit_case_statement,
+            "update_expression": self._visit_update_expression,
+            "conditional_expression": self._visit_conditional_expression,
+            "declaration": self._visit_declaration,
+            "assignment_expression": self._visit_assignment_expression,
+            "return_statement": self._visit_return_statement,
+            "call_expression": self._visit_call_expression,
+        })
+
+    def instrument(self, out=None, tree=None) -> bytes | None:
+        """Return the instrumented source, or write it to ``out`` if given."""
+        self._var_fmt = dict(self.symbol_table.var_fmts)
+        if tree is None:
+            tree = self.ts_parser.parse(self.code_bytes)
         self._traverse(tree.root_node)
-        return self._build_output()
+        if out is None:
+            return b"".join(self._build_output())
+        out.writelines(self._build_output())
+        return None
 
     # ── helpers ───────────────────────────────────────────────────
 
-    def _add_after(self, line_idx, code):
-        self.insertions.setdefault(line_idx, []).append(code)
+    def _add_after(self, line_idx, code: bytes):
+        self.edits.append((2 * line_idx + 1, code))
 
-    def _add_before(self, line_idx, code):
-        self.pre_insertions.setdefault(line_idx, []).append(code)
+    def _add_before(self, line_idx, code: bytes):
+        self.edits.append((2 * line_idx, code))
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def _make_trace(parts):
+        """Build a single printf() call emitting NUL-separated fields.
+
+        ``parts`` must be a tuple so repeated trace shapes hit the cache.
+        Plain strings are constant fields and go straight into the format
+        string (with ``%`` doubled); ``(fmt, expr)`` pairs are runtime
+        values. A literal NUL would terminate the format string, so
+        separators are written through ``%c`` with a ``0`` argument instead,
+        and text holding escape sequences (which may spell a NUL, as in
+        ``'\\0'``) is still passed through ``%s``, where it is cut short
+        exactly as before.
+        """
         fmt_parts = []
         args = []
-        for part in parts:
+        for i, part in enumerate(parts):
+            if i:
+                args.append("0")
             if isinstance(part, tuple):
                 fmt_parts.append(part[0])
                 args.append(part[1])
-            else:
+            elif "\\" in part:
                 fmt_parts.append("%s")
                 args.append(f'"{part}"')
+            else:
+                fmt_parts.append(part.replace("%", "%%"))
+
+        fmt = "%c".join(fmt_parts).encode("utf-8")
+        if not args:
+            return b"".join((_PRINTF_OPEN, fmt, _PRINTF_NO_ARGS, _PRINTF_CLOSE))
+        return b"".join(
+            (
+                _PRINTF_OPEN,
+                fmt,
+                _PRINTF_ARGS,
+                ", ".join(args).encode("utf-8"),
+                _PRINTF_CLOSE,
+            )
+        )
 
-        statements = []
-        for i, (fmt, arg) in enumerate(zip(fmt_parts, args)):
-            statements.append(f'printf("{fmt}", {arg})')
-            if i < len(fmt_parts) - 1:
-                statements.append("putchar(0)")
-        statements.append("putchar('\\n')")
+    # Fast paths for the most frequent trace shapes. They produce exactly
+    # what _make_trace would for the same fields, without the generic loop.
 
-        return "    " + "; ".join(statements) + ";"
+    @staticmethod
+    def _trace_var(tag, var, fmt, line_no):
+        """``tag var value &var line depth`` (DECL/READ/ASSIGN/RETURN)."""
+        var_b = var.encode("utf-8")
+        return _TRACE_VAR % (
+            tag.encode("utf-8"), var_b, fmt.encode("utf-8"), line_no, var_b, var_b
+        )
+
+    @staticmethod
+    def _trace_branch(kind, cond_text, line_no):
+        """``BRANCH kind condition line depth``."""
+        if "\\" in cond_text:
+            return CInstrumenter._make_trace(
+                ("BRANCH", kind, cond_text, str(line_no), ("%d", "__stack_depth"))
+            )
+        return _TRACE_BRANCH % (
+            kind.encode("utf-8"),
+            cond_text.replace("%", "%%").encode("utf-8"),
+            line_no,
+        )
 
     def _build_output(self):
+        """Yield the instrumented program as a sequence of byte segments.
+
+        Insertions are sorted once; the source between them is yielded as
+        whole multi-line views into the original text, so it is never
+        decoded, split or copied.
+        """
+        text = self.text
+        starts = self.line_starts
+        num_lines = len(starts)
+        last_end = len(text) - 1 if text.endswith(b"\n") else len(text)
+
+        def line_end(k):
+            return starts[k + 1] - 1 if k + 1 < num_lines else last_end
+
         # Check if stdio.h is already included
         has_stdio = False
-        first_non_include_line = 0
-        
-        for i, line in enumerate(self.lines):
-            stripped = line.strip()
-            if stripped.startswith("#include"):
-                if "stdio.h" in stripped:
+        for k in range(num_lines):
+            stripped = text[starts[k] : line_end(k)].strip()
+            if stripped.startswith(b"#include"):
+                if b"stdio.h" in stripped:
                     has_stdio = True
-                first_non_include_line = i + 1
-            elif stripped and not stripped.startswith("//") and not stripped.startswith("/*"):
-                # Found first non-include, non-comment line
-                if not has_stdio:
-                    # Stop looking after we pass the include section
                     break
-        
-        result = []
-        
+            elif stripped and not stripped.startswith((b"//", b"/*")):
+                # Stop looking after we pass the include section
+                break
+
         # Add stdio.h if not present
         if not has_stdio:
-            result.append("#include <stdio.h>")
-            result.append("")
-        
+            yield b"#include <stdio.h>\n\n"
+
         # Add global stack depth variable
-        result.append("int __stack_depth = 0;")
-        
-        # Add the rest of the code
-        for i, line in enumerate(self.lines):
-            if i in self.pre_insertions:
-                result.extend(self.pre_insertions[i])
-            result.append(line)
-            if i in self.insertions:
-                result.extend(self.insertions[i])
-        return "\n".join(result)
+        yield b"int __stack_depth = 0;"
+
+        # Add the rest of the code: each source line is preceded by "\n",
+        # which for a run of lines is one "\n" plus the span between them
+        view = memoryview(text)
+        done = 0
+        end_slot = 2 * num_lines
+        self.edits.sort(key=_EDIT_ORDER)
+        for slot, code in self.edits:
+            if slot >= end_slot:
+                break
+            # Lines that must already be out: up to this one if inserting
+            # after it, up to the previous one if inserting before it
+            upto = (slot + 1) >> 1
+            if upto > done:
+                yield b"\n"
+                yield view[starts[done] : line_end(upto - 1)]
+                done = upto
+            yield code
+        if done < num_lines:
+            yield b"\n"
+            yield view[starts[done] : last_end]
 
     # ── AST traversal ────────────────────────────────────────────
 
-    def _traverse(self, node):
-        visitor = getattr(self, f"_visit_{node.type}", None)
-        if visitor:
-            visitor(node)
-        for child in node.children:
-            self._traverse(child)
+    def _traverse(self, root):
+        dispatch = self._dispatch
+        cursor = root.walk()
+        while True:
+            node = cursor.node
+            kind = node.kind_id
+            if kind in _FUNCTION_DEFINITION_KINDS:
+                self._function_depth += 1
+            visitor = dispatch.get(kind)
+            if visitor:
+                visitor(node)
+            if kind not in _PRUNED_KINDS and cursor.goto_first_child():
+                continue
+            if kind in _FUNCTION_DEFINITION_KINDS:
+                self._function_depth -= 1
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return
+                if cursor.node.kind_id in _FUNCTION_DEFINITION_KINDS:
+                    self._function_depth -= 1
 
     def _collect_reads(self, node):
+        code_bytes = self.code_bytes
+        declared_vars = self.declared_vars
+        exclude_kinds = self._EXCLUDE_KINDS
+        keywords = _KEYWORD_BYTES
         reads = []
-
-        def walk(n):
-            if n.type == "identifier":
-                parent = n.parent
-                if not parent or parent.type not in self.EXCLUDE_TYPES:
+        add_read = reads.append
+
+        # The cursor cannot see above ``node``, so its parent is resolved
+        # up front; below it, enclosing kinds are kept on a stack.
+        root_parent = node.parent
+        root_is_callee = (
+            root_parent is not None
+            and root_parent.type == "call_expression"
+            and root_parent.child_by_field_name("function") == node
+        )
+        parent_kinds = [root_parent.kind_id if root_parent else None]
+        push_parent = parent_kinds.append
+        pop_parent = parent_kinds.pop
+        cursor = node.walk()
+        goto_first_child = cursor.goto_first_child
+        goto_next_sibling = cursor.goto_next_sibling
+        goto_parent = cursor.goto_parent
+        while True:
+            n = cursor.node
+            n_kind = n.kind_id
+            if n_kind in _IDENTIFIER_KINDS:
+                parent_kind = parent_kinds[-1]
+                if parent_kind not in exclude_kinds:
                     # Skip function names in call expressions
-                    if (
-                        parent
-                        and parent.type == "call_expression"
-                        and parent.child_by_field_name("function") == n
-                    ):
-                        pass
+                    if len(parent_kinds) == 1:
+                        is_callee = root_is_callee
                     else:
-                        name = get_text(n, self.code_bytes)
-                        if name not in KEYWORDS and name in self.declared_vars:
-                            reads.append(name)
-            for c in n.children:
-                walk(c)
-
-        walk(node)
-        return reads
+                        is_callee = (
+                            parent_kind in _CALL_KINDS
+                            and cursor.field_name == "function"
+                        )
+                    if not is_callee:
+                        raw = code_bytes[n.start_byte : n.end_byte]
+                        # declared_vars is the smaller, more selective set;
+                        # only names that will be traced get decoded
+                        if raw in declared_vars and raw not in keywords:
+                            add_read(get_ident(n, code_bytes))
+            if goto_first_child():
+                push_parent(n_kind)
+                continue
+            while not goto_next_sibling():
+                if not goto_parent():
+                    return reads
+                pop_parent()
 
     # ── visitors ─────────────────────────────────────────────────
 
     def _visit_function_definition(self, node):
         func_name = None
         params = []
+        param_fmts = {}
 
         for child in node.children:
             if child.type == "function_declarator":
                 for sub in child.children:
                     if sub.type == "identifier":
-                        func_name = get_text(sub, self.code_bytes)
+                        func_name = get_ident(sub, self.code_bytes)
                     elif sub.type == "parameter_list":
                         for p in sub.children:
                             if p.type == "parameter_declaration":
                                 p_name = extract_var_name(p, self.code_bytes)
                                 if p_name:
                                     params.append(p_name)
+                                    declarator_node = p.child_by_field_name("declarator")
+                                    if declarator_node:
+                                        param_fmts[p_name] = self.symbol_table.get_decl_fmt(
+                                            declarator_node.start_byte, "%d"
+                                        )
 
         if not func_name:
             return
@@ -427,83 +762,44 @@ class CInstrumenter:
         start_line = body.start_point[0]
 
         if func_name == "main":
-            self._add_after(start_line, "    setbuf(stdout, NULL);")
+            self._add_after(start_line, _SETBUF)
 
         if func_name == "main" and self.metadata:
             for key, val in self.metadata.items():
-                trace = self._make_trace(["META", str(key), str(val)])
+                trace = self._make_trace(("META", str(key), str(val)))
                 self._add_after(start_line, trace)
 
-        self._add_after(start_line, "    __stack_depth++;")
-        
+        self._add_after(start_line, _DEPTH_INC)
+
         # Mark parameters as declared
         for p in params:
-            self.declared_vars.add(p)
-
-        # Build parameter types from function definition
-        param_types = {}
-        declarator = node.child_by_field_name("declarator")
-        if declarator:
-            params_node = declarator.child_by_field_name("parameters")
-            if params_node:
-                for child in params_node.children:
-                    if child.type == "parameter_declaration":
-                        type_node = child.child_by_field_name("type")
-                        declarator_node = child.child_by_field_name("declarator")
-                        if type_node and declarator_node:
-                            var_name = extract_var_name(declarator_node, self.code_bytes)
-                            base_type = get_text(type_node, self.code_bytes)
-                            if declarator_node.type == "pointer_declarator":
-                                full_type = base_type + " *"
-                            elif declarator_node.type == "array_declarator":
-                                full_type = base_type + " *"
-                            else:
-                                full_type = base_type
-                            if var_name:
-                                param_types[var_name] = full_type
+            self.declared_vars.add(p.encode("utf-8"))
+            self._var_fmt[p] = param_fmts.get(p, "%d")
 
         parts = ["CALL", func_name]
-        if params:
-            for p in params:
-                param_type = param_types.get(p, "int")
-                parts.append((_type_fmt(param_type), p))
+        for p in params:
+            parts.append((self._var_fmt[p], p))
         parts.append(("%d", "__stack_depth"))
 
-        self._add_after(start_line, self._make_trace(parts))
+        self._add_after(start_line, self._make_trace(tuple(parts)))
 
     def _visit_parameter_declaration(self, node):
-        parent = node.parent
-        while parent:
-            if parent.type == "function_definition":
-                break
-            parent = parent.parent
-        else:
+        # Prototypes outside any function definition are not traced
+        if not self._function_depth:
             return
 
         var_name = extract_var_name(node, self.code_bytes)
         if var_name:
             line = node.start_point[0]
-            # Extract type directly from this node, not from symbol table
-            base_type_node = node.child_by_field_name("type")
+            # Type of this particular parameter, not of the name in general
             declarator_node = node.child_by_field_name("declarator")
-            
-            if base_type_node:
-                base_type = get_text(base_type_node, self.code_bytes)
-                if declarator_node:
-                    if declarator_node.type == "pointer_declarator":
-                        var_type = base_type + " *"
-                    elif declarator_node.type == "array_declarator":
-                        var_type = base_type + " *"
-                    else:
-                        var_type = base_type
-                else:
-                    var_type = base_type
-            else:
-                var_type = "int"  # Default type
-            
-            fmt = _type_fmt(var_type)
+            fmt = (
+                self.symbol_table.get_decl_fmt(declarator_node.start_byte, "%d")
+                if declarator_node
+                else "%d"
+            )
             trace = self._make_trace(
-                ["PARAM", var_name, (fmt, var_name), str(line + 1)]
+                ("PARAM", var_name, (fmt, var_name), str(line + 1))
             )
             self._add_after(line, trace)
 
@@ -514,22 +810,20 @@ class CInstrumenter:
         if cond_expr:
             if_line = node.start_point[0]
             trace = self._make_trace(
-                [
+                (
                     "CONDITION",
                     cond_text,
                     ("%d", cond_expr),
                     str(if_line + 1),
                     ("%d", "__stack_depth"),
-                ]
+                )
             )
             self._add_before(if_line, trace)
 
         consequence = node.child_by_field_name("consequence")
         if consequence:
             line = consequence.start_point[0]
-            trace = self._make_trace(
-                ["BRANCH", "if", cond_text, str(line + 1), ("%d", "__stack_depth")]
-            )
+            trace = self._trace_branch("if", cond_text, line + 1)
             if consequence.type == "compound_statement":
                 self._add_after(line, trace)
             else:
@@ -544,9 +838,7 @@ class CInstrumenter:
                         alt_body = child
                         break
 
-            trace = self._make_trace(
-                ["BRANCH", "else", cond_text, str(line + 1), ("%d", "__stack_depth")]
-            )
+            trace = self._trace_branch("else", cond_text, line + 1)
             if alt_body.type == "compound_statement":
                 line = alt_body.start_point[0]
                 self._add_after(line, trace)
@@ -562,18 +854,18 @@ class CInstrumenter:
         line = body.start_point[0]
         if cond_expr:
             trace = self._make_trace(
-                [
+                (
                     "LOOP",
                     "while",
                     cond_text,
                     ("%d", cond_expr),
                     str(line + 1),
                     ("%d", "__stack_depth"),
-                ]
+                )
             )
         else:
             trace = self._make_trace(
-                ["LOOP", "while", "", "1", str(line + 1), ("%d", "__stack_depth")]
+                ("LOOP", "while", "", "1", str(line + 1), ("%d", "__stack_depth"))
             )
         self._add_after(line, trace)
 
@@ -585,18 +877,18 @@ class CInstrumenter:
         line = body.start_point[0]
         if cond_expr:
             trace = self._make_trace(
-                [
+                (
                     "LOOP",
                     "for",
                     cond_text,
                     ("%d", cond_expr),
                     str(line + 1),
                     ("%d", "__stack_depth"),
-                ]
+                )
             )
         else:
             trace = self._make_trace(
-                ["LOOP", "for", "", "1", str(line + 1), ("%d", "__stack_depth")]
+                ("LOOP", "for", "", "1", str(line + 1), ("%d", "__stack_depth"))
             )
         self._add_after(line, trace)
 
@@ -608,18 +900,18 @@ class CInstrumenter:
         line = body.start_point[0]
         if cond_expr:
             trace = self._make_trace(
-                [
+                (
                     "LOOP",
                     "do-while",
                     cond_text,
                     ("%d", cond_expr),
                     str(line + 1),
                     ("%d", "__stack_depth"),
-                ]
+                )
             )
         else:
             trace = self._make_trace(
-                ["LOOP", "do-while", "", "1", str(line + 1), ("%d", "__stack_depth")]
+                ("LOOP", "do-while", "", "1", str(line + 1), ("%d", "__stack_depth"))
             )
         self._add_after(line, trace)
 
@@ -628,13 +920,13 @@ class CInstrumenter:
         line = node.start_point[0]
         if cond_expr:
             trace = self._make_trace(
-                [
+                (
                     "SWITCH",
                     cond_text,
                     ("%d", cond_expr),
                     str(line + 1),
                     ("%d", "__stack_depth"),
-                ]
+                )
             )
             self._add_before(line, trace)
 
@@ -643,13 +935,13 @@ class CInstrumenter:
         value_node = node.child_by_field_name("value")
         if value_node:
             value_text = get_text(value_node, self.code_bytes)
-            safe_text = value_text.replace("%", "%%").replace('"', '\\"')
+            safe_text = _escape(value_text)
             trace = self._make_trace(
-                ["CASE", safe_text, str(line + 1), ("%d", "__stack_depth")]
+                ("CASE", safe_text, str(line + 1), ("%d", "__stack_depth"))
             )
         else:
             trace = self._make_trace(
-                ["CASE", "default", str(line + 1), ("%d", "__stack_depth")]
+                ("CASE", "default", str(line + 1), ("%d", "__stack_depth"))
             )
         self._add_after(line, trace)
 
@@ -659,16 +951,16 @@ class CInstrumenter:
         var_name = None
         for child in node.children:
             if child.type == "identifier":
-                var_name = get_text(child, self.code_bytes)
+                var_name = get_ident(child, self.code_bytes)
                 break
         if not var_name or var_name in KEYWORDS:
             return
         line = node.start_point[0]
         full_text = get_text(node, self.code_bytes)
         op = "++" if "++" in full_text else "--"
-        fmt = _type_fmt(self.symbol_table.get_type(var_name, "int"))
+        fmt = self._var_fmt.get(var_name, "%d")
         trace = self._make_trace(
-            [
+            (
                 "UPDATE",
                 var_name,
                 op,
@@ -676,7 +968,7 @@ class CInstrumenter:
                 ("%p", f"&{var_name}"),
                 str(line + 1),
                 ("%d", "__stack_depth"),
-            ]
+            )
         )
         self._add_after(line, trace)
 
@@ -685,73 +977,44 @@ class CInstrumenter:
         if not condition:
             return
         cond_text = get_text(condition, self.code_bytes)
-        safe_text = cond_text.replace("%", "%%").replace('"', '\\"')
+        safe_text = _escape(cond_text)
         line = node.start_point[0]
         trace = self._make_trace(
-            [
+            (
                 "TERNARY",
                 safe_text,
                 ("%d", cond_text),
                 str(line + 1),
                 ("%d", "__stack_depth"),
-            ]
+            )
         )
         self._add_before(line, trace)
 
     def _visit_declaration(self, node):
-        # Extract and store type information
-        type_node = node.child_by_field_name("type")
-        base_type = get_text(type_node, self.code_bytes) if type_node else "int"
-        
         for child in node.children:
             if child.type == "init_declarator":
                 declarator_node = child.child_by_field_name("declarator")
                 var_name = extract_var_name(declarator_node, self.code_bytes) if declarator_node else None
                 if not var_name:
                     continue
-                
-                # Build full type with pointer/array modifiers and store
-                if declarator_node.type == "pointer_declarator":
-                    full_type = base_type + " *"
-                elif declarator_node.type == "array_declarator":
-                    full_type = base_type + " *"
-                else:
-                    full_type = base_type
-                self.local_var_types[var_name] = full_type
-                self.declared_vars.add(var_name)
-                
+
+                # Format of the full type (with pointer/array modifiers) was
+                # resolved by CTypeAnalyzer for this exact declarator
+                fmt = self.symbol_table.get_decl_fmt(declarator_node.start_byte, "%d")
+                self.declared_vars.add(var_name.encode("utf-8"))
+                self._var_fmt[var_name] = fmt
+
                 line = node.start_point[0]
-                fmt = _type_fmt(full_type)
 
-                trace = self._make_trace(
-                    [
-                        "DECL",
-                        var_name,
-                        (fmt, var_name),
-                        ("%p", f"&{var_name}"),
-                        str(line + 1),
-                        ("%d", "__stack_depth"),
-                    ]
-                )
+                trace = self._trace_var("DECL", var_name, fmt, line + 1)
                 self._add_after(line, trace)
 
                 # Only collect reads from the initializer value, not the declarator
                 value_node = child.child_by_field_name("value")
                 if value_node:
                     for read_var in self._collect_reads(value_node):
-                        # Use local type map exclusively
-                        read_type = self.local_var_types.get(read_var, "int")
-                        r_fmt = _type_fmt(read_type)
-                        trace = self._make_trace(
-                            [
-                                "READ",
-                                read_var,
-                                (r_fmt, read_var),
-                                ("%p", f"&{read_var}"),
-                                str(line + 1),
-                                ("%d", "__stack_depth"),
-                            ]
-                        )
+                        r_fmt = self._var_fmt.get(read_var, "%d")
+                        trace = self._trace_var("READ", read_var, r_fmt, line + 1)
                         self._add_before(line, trace)
 
     def _visit_assignment_expression(self, node):
@@ -760,7 +1023,7 @@ class CInstrumenter:
 
         left_var = None
         if left and left.type == "identifier":
-            left_var = get_text(left, self.code_bytes)
+            left_var = get_ident(left, self.code_bytes)
 
         if not left_var:
             return
@@ -780,7 +1043,7 @@ class CInstrumenter:
         read_vars = []
         if right:
             if right.type == "identifier":
-                name = get_text(right, self.code_bytes)
+                name = get_ident(right, self.code_bytes)
                 if name not in KEYWORDS:
                     read_vars.append(name)
             else:
@@ -792,65 +1055,38 @@ class CInstrumenter:
 
         # Emit READ traces before the line
         for read_var in read_vars:
-            r_fmt = _type_fmt(self.symbol_table.get_type(read_var, "int"))
-            trace = self._make_trace(
-                [
-                    "READ",
-                    read_var,
-                    (r_fmt, read_var),
-                    ("%p", f"&{read_var}"),
-                    str(line + 1),
-                    ("%d", "__stack_depth"),
-                ]
-            )
+            r_fmt = self._var_fmt.get(read_var, "%d")
+            trace = self._trace_var("READ", read_var, r_fmt, line + 1)
             self._add_before(line, trace)
 
         # Emit ASSIGN trace after the line
-        fmt = _type_fmt(self.symbol_table.get_type(left_var, "int"))
-        trace = self._make_trace(
-            [
-                "ASSIGN",
-                left_var,
-                (fmt, left_var),
-                ("%p", f"&{left_var}"),
-                str(line + 1),
-                ("%d", "__stack_depth"),
-            ]
-        )
+        fmt = self._var_fmt.get(left_var, "%d")
+        trace = self._trace_var("ASSIGN", left_var, fmt, line + 1)
         self._add_after(line, trace)
 
     def _visit_return_statement(self, node):
         line = node.start_point[0]
         for child in node.children:
             if child.type == "identifier":
-                var_name = get_text(child, self.code_bytes)
+                var_name = get_ident(child, self.code_bytes)
                 if var_name not in KEYWORDS:
-                    fmt = _type_fmt(self.symbol_table.get_type(var_name, "int"))
-                    trace = self._make_trace(
-                        [
-                            "RETURN",
-                            var_name,
-                            (fmt, var_name),
-                            ("%p", f"&{var_name}"),
-                            str(line + 1),
-                            ("%d", "__stack_depth"),
-                        ]
-                    )
+                    fmt = self._var_fmt.get(var_name, "%d")
+                    trace = self._trace_var("RETURN", var_name, fmt, line + 1)
                     self._add_before(line, trace)
             elif child.type in ("number_literal", "string_literal"):
                 val = get_text(child, self.code_bytes)
                 trace = self._make_trace(
-                    [
+                    (
                         "RETURN",
                         "literal",
                         val,
                         "0",
                         str(line + 1),
                         ("%d", "__stack_depth"),
-                    ]
+                    )
                 )
                 self._add_before(line, trace)
-        self._add_before(line, "    __stack_depth--;")
+        self._add_before(line, _DEPTH_DEC)
 
     def _visit_call_expression(self, node):
         """Handle function calls - mark external calls with EXTERNAL_CALL trace."""
@@ -858,23 +1094,24 @@ class CInstrumenter:
         if not func_node:
             return
         
-        # Get the function name
-        func_name = get_text(func_node, self.code_bytes)
+        # Get the function name as raw bytes; it is only decoded if traced
+        func_raw = self.code_bytes[func_node.start_byte : func_node.end_byte]
         
         # Skip if it's a known keyword or built-in function
-        if func_name in KEYWORDS:
+        if func_raw in _KEYWORD_BYTES:
             return
         
         # Check if this is an external function (not defined in current file)
-        if func_name not in self.defined_functions:
+        if func_raw not in self.defined_functions:
+            func_name = get_ident(func_node, self.code_bytes)
             line = node.start_point[0]
             trace = self._make_trace(
-                [
+                (
                     "EXTERNAL_CALL",
                     func_name,
                     str(line + 1),
                     ("%d", "__stack_depth"),
-                ]
+                )
             )
             self._add_before(line, trace)
 
@@ -888,13 +1125,17 @@ class CLanguage(LanguageSupport):
     extensions = frozenset({".c", ".h"})
 
     def get_ts_language(self):
-        return Language(language())
+        return C_LANGUAGE
 
-    def analyze_types(self, ts_parser, code_bytes):
-        return CTypeAnalyzer(ts_parser, code_bytes).analyze()
+    def analyze_types(self, ts_parser, code_bytes, tree=None):
+        return CTypeAnalyzer(ts_parser, code_bytes).analyze(tree)
 
-    def collect_metadata(self, ts_parser, code_bytes, source_file):
-        return CMetadataCollector(ts_parser, code_bytes, source_file).collect()
+    def collect_metadata(self, ts_parser, code_bytes, source_file, tree=None):
+        return CMetadataCollector(ts_parser, code_bytes, source_file).collect(tree)
 
-    def instrument(self, ts_parser, code_bytes, symbol_table, metadata):
-        return CInstrumenter(ts_parser, code_bytes, symbol_table, metadata).instrument()
+    def instrument(
+        self, ts_parser, code_bytes, symbol_table, metadata, out=None, tree=None
+    ):
+        return CInstrumenter(ts_parser, code_bytes, symbol_table, metadata).instrument(
+            out, tree
+        )
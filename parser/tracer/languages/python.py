@@ -1,15 +1,16 @@
-import os
-import stat
-import time
+import operator
+import sys
+from bisect import bisect_left
+from collections import defaultdict
 
-from tree_sitter import Language
+from tree_sitter import Language, Query, QueryCursor
 from tree_sitter_python import language
 
 from ..base import LanguageSupport
-from ..core import SymbolTable, get_text
+from ..core import SymbolTable, file_info, get_ident, get_text
 from ..registry import register
 
-KEYWORDS = {
+KEYWORDS = frozenset(map(sys.intern, {
     "print",
     "return",
     "if",
@@ -46,7 +47,89 @@ KEYWORDS = {
     "del",
     "self",
     "__tracer_depth",
-}
+}))
+# Same names as raw source bytes, for testing identifiers before decoding
+_KEYWORD_BYTES = frozenset(k.encode("utf-8") for k in KEYWORDS)
+
+_PY_LANGUAGE = Language(language())
+
+# Names bound by plain ``x = ...`` assignments and by function parameters.
+_TYPE_QUERY = Query(
+    _PY_LANGUAGE,
+    """
+    (assignment left: (identifier) @name)
+    (function_definition parameters: (parameters (identifier) @name))
+    """,
+)
+
+# Nodes the instrumenter has visitors for, plus the elif/else clauses the
+# walk has to step over.
+_INSTRUMENT_QUERY = Query(
+    _PY_LANGUAGE,
+    """
+    (function_definition) @function_definition
+    (assignment) @assignment
+    (augmented_assignment) @augmented_assignment
+    (if_statement) @if_statement
+    (for_statement) @for_statement
+    (while_statement) @while_statement
+    (return_statement) @return_statement
+    (call) @call
+    (elif_clause) @elif_clause
+    (else_clause) @else_clause
+    """,
+)
+
+# Everything the metadata pass counts.
+_METADATA_QUERY = Query(
+    _PY_LANGUAGE,
+    """
+    (function_definition) @function
+    (assignment) @assignment
+    (augmented_assignment) @augmented_assignment
+    [(while_statement) (for_statement)] @loop
+    (if_statement) @branch
+    (return_statement) @return
+    (call) @call
+    (comment) @comment
+    [(import_statement) (import_from_statement)] @import
+    (block) @block
+    """,
+)
+
+
+# Indentation prefixes for the common columns, shared by every trace line
+_INDENTS = tuple(b" " * n for n in range(65))
+
+
+def _indent(n):
+    """Return ``n`` spaces as bytes, reusing a prebuilt prefix when possible."""
+    return _INDENTS[n] if n < 65 else b" " * n
+
+
+_START_BYTE = operator.attrgetter("start_byte")
+_CAPTURE_ORDER = operator.itemgetter(0, 1)
+
+
+def _in_source_order(nodes):
+    """Captures are grouped per pattern; restore pre-order (start byte)."""
+    return sorted(nodes, key=_START_BYTE)
+
+
+def _max_block_depth(blocks):
+    """Return how deeply ``blocks`` (given in source order) nest."""
+    max_depth = 0
+    open_ends = []
+    for block in blocks:
+        end = block.end_byte
+        # Blocks are ordered by start byte, so the enclosing ones are
+        # exactly those on the stack that have not ended before this one.
+        while open_ends and open_ends[-1] < end:
+            open_ends.pop()
+        open_ends.append(end)
+        if len(open_ends) > max_depth:
+            max_depth = len(open_ends)
+    return max_depth
 
 
 # ── Type analysis ────────────────────────────────────────────────────
@@ -60,26 +143,16 @@ class PythonTypeAnalyzer:
         self.code_bytes = code_bytes
         self.symbol_table = SymbolTable()
 
-    def analyze(self) -> SymbolTable:
-        tree = self.ts_parser.parse(self.code_bytes)
+    def analyze(self, tree=None) -> SymbolTable:
+        if tree is None:
+            tree = self.ts_parser.parse(self.code_bytes)
         self._collect(tree.root_node)
         return self.symbol_table
 
-    def _collect(self, node):
-        if node.type == "assignment":
-            left = node.child_by_field_name("left")
-            if left and left.type == "identifier":
-                name = get_text(left, self.code_bytes)
-                self.symbol_table.register(name, "object")
-        elif node.type == "function_definition":
-            params = node.child_by_field_name("parameters")
-            if params:
-                for child in params.children:
-                    if child.type == "identifier":
-                        name = get_text(child, self.code_bytes)
-                        self.symbol_table.register(name, "object")
-        for child in node.children:
-            self._collect(child)
+    def _collect(self, root):
+        captures = QueryCursor(_TYPE_QUERY).captures(root)
+        for node in _in_source_order(captures.get("name", ())):
+            self.symbol_table.register(get_ident(node, self.code_bytes), "object")
 
 
 # ── Metadata collection ─────────────────────────────────────────────
@@ -104,23 +177,16 @@ class PythonMetadataCollector:
         self.imports: list[str] = []
         self.defined_functions: set[str] = set()
 
-    def collect(self) -> dict:
+    def collect(self, tree=None) -> dict:
         code_text = self.code_bytes.decode("utf-8")
-        tree = self.ts_parser.parse(self.code_bytes)
-        self._extract_imports(tree.root_node)
-        self._walk(tree.root_node, depth=0)
+        if tree is None:
+            tree = self.ts_parser.parse(self.code_bytes)
+        self._walk(tree.root_node)
 
-        st = os.stat(self.source_file)
-        total_lines = code_text.count("\n") + 1
+        total_lines = self.code_bytes.count(b"\n") + 1
 
         return {
-            "file_name": os.path.basename(self.source_file).replace("\\", "/"),
-            "file_path": os.path.abspath(self.source_file).replace("\\", "/"),
-            "file_size": st.st_size,
-            "file_mode": stat.filemode(st.st_mode),
-            "modified": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_mtime)),
-            "accessed": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_atime)),
-            "created": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(st.st_ctime)),
+            **file_info(self.source_file),
             "language": "Python",
             "total_lines": total_lines,
             "non_blank_lines": sum(1 for ln in code_text.splitlines() if ln.strip()),
@@ -139,98 +205,108 @@ class PythonMetadataCollector:
             "defined_functions": ",".join(sorted(self.defined_functions)),
         }
 
-    def _extract_imports(self, node):
-        """Walk the AST and extract imported module names."""
-        if node.type == "import_statement":
-            # import module or import module as alias
-            for child in node.children:
-                if child.type == "dotted_name" or child.type == "identifier":
-                    module_name = get_text(child, self.code_bytes)
-                    self.imports.append(module_name)
-        elif node.type == "import_from_statement":
-            # from module import ...
-            module_node = node.child_by_field_name("module_name")
-            if module_node:
-                module_name = get_text(module_node, self.code_bytes)
-                self.imports.append(module_name)
-        for child in node.children:
-            self._extract_imports(child)
+    def _walk(self, root):
+        """Gather every counter and import from one query over the tree."""
+        code_bytes = self.code_bytes
+        captures = QueryCursor(_METADATA_QUERY).captures(root)
 
-    def _walk(self, node, depth):
-        if node.type == "function_definition":
-            self.num_functions += 1
+        functions = _in_source_order(captures.get("function", ()))
+        self.num_functions = len(functions)
+        for node in functions:
             name_node = node.child_by_field_name("name")
             if name_node:
-                func_name = get_text(name_node, self.code_bytes)
+                func_name = get_text(name_node, code_bytes)
                 self.function_names.append(func_name)
                 self.defined_functions.add(func_name)
-        elif node.type == "assignment":
-            self.num_variables += 1
-            self.num_assignments += 1
-        elif node.type == "augmented_assignment":
-            self.num_assignments += 1
-        elif node.type in ("while_statement", "for_statement"):
-            self.num_loops += 1
-        elif node.type == "if_statement":
-            self.num_branches += 1
-        elif node.type == "return_statement":
-            self.num_returns += 1
-        elif node.type == "call":
-            self.num_calls += 1
-        elif node.type == "comment":
-            self.num_comments += 1
-        elif node.type in ("import_statement", "import_from_statement"):
-            self.num_imports += 1
-
-        # Track nesting via block nodes (indented suites)
-        if node.type == "block":
-            depth += 1
-            if depth > self.max_depth:
-                self.max_depth = depth
 
-        for child in node.children:
-            self._walk(child, depth)
+        self.num_variables = len(captures.get("assignment", ()))
+        self.num_assignments = self.num_variables + len(
+            captures.get("augmented_assignment", ())
+        )
+        self.num_loops = len(captures.get("loop", ()))
+        self.num_branches = len(captures.get("branch", ()))
+        self.num_returns = len(captures.get("return", ()))
+        self.num_calls = len(captures.get("call", ()))
+        self.num_comments = len(captures.get("comment", ()))
+
+        imports = _in_source_order(captures.get("import", ()))
+        self.num_imports = len(imports)
+        for node in imports:
+            if node.type == "import_statement":
+                # import module or import module as alias
+                for child in node.children:
+                    if child.type == "dotted_name" or child.type == "identifier":
+                        self.imports.append(get_text(child, code_bytes))
+            else:
+                # from module import ...
+                module_node = node.child_by_field_name("module_name")
+                if module_node:
+                    self.imports.append(get_text(module_node, code_bytes))
+
+        self.max_depth = _max_block_depth(
+            _in_source_order(captures.get("block", ()))
+        )
 
 
 # ── Code instrumentation ────────────────────────────────────────────
 
 
 class PythonInstrumenter:
-    EXCLUDE_IDENTS = {
+    EXCLUDE_IDENTS = frozenset({
         "assignment",
         "augmented_assignment",
         "function_definition",
         "parameters",
-    }
+    })
 
-    def __init__(self, ts_parser, code_bytes, symbol_table, metadata=None):
+    def __init__(
+        self, ts_parser, code_bytes, symbol_table, metadata=None, defined_functions=None
+    ):
         self.ts_parser = ts_parser
         self.code_bytes = code_bytes
         self.symbol_table = symbol_table
         self.metadata = metadata or {}
-        self.lines = code_bytes.decode("utf-8").splitlines()
-        self.insertions: dict[int, list[str]] = {}
-        self.pre_insertions: dict[int, list[str]] = {}
+        # Source and output stay UTF-8 bytes throughout; only the text of
+        # each generated trace line is built as str and encoded once.
+        self.lines = code_bytes.splitlines()
+        self.insertions: defaultdict[int, list[bytes]] = defaultdict(list)
+        self.pre_insertions: defaultdict[int, list[bytes]] = defaultdict(list)
         self.seen_vars: set[str] = set()
-        # Parse defined functions from metadata
-        self.defined_functions = set()
-        if metadata and "defined_functions" in metadata:
-            func_str = metadata["defined_functions"]
-            if func_str:
-                self.defined_functions = set(func_str.split(","))
-
-    def instrument(self) -> str:
-        tree = self.ts_parser.parse(self.code_bytes)
+        # Functions defined in this file, parsed once from the metadata's
+        # comma-joined list unless given as a set
+        if defined_functions is None:
+            func_str = self.metadata.get("defined_functions")
+            defined_functions = frozenset(func_str.split(",")) if func_str else frozenset()
+        self.defined_functions = defined_functions
+        self._line_indents: dict[int, int] = {}
+        self._captured: list = []
+        self._capture_starts: list[int] = []
+        # capture name -> bound visitor, built once instead of per node
+        self._dispatch = {
+            "function_definition": self._visit_function_definition,
+            "assignment": self._visit_assignment,
+            "augmented_assignment": self._visit_augmented_assignment,
+            "if_statement": self._visit_if_statement,
+            "for_statement": self._visit_for_statement,
+            "while_statement": self._visit_while_statement,
+            "return_statement": self._visit_return_statement,
+            "call": self._visit_call,
+        }
+
+    def instrument(self, tree=None) -> bytes:
+        if tree is None:
+            tree = self.ts_parser.parse(self.code_bytes)
+        self._capture(tree.root_node)
         self._traverse(tree.root_node)
         return self._build_output()
 
     # ── helpers ───────────────────────────────────────────────────
 
     def _add_after(self, line_idx, code):
-        self.insertions.setdefault(line_idx, []).append(code)
+        self.insertions[line_idx].append(code)
 
     def _add_before(self, line_idx, code):
-        self.pre_insertions.setdefault(line_idx, []).append(code)
+        self.pre_insertions[line_idx].append(code)
 
     @staticmethod
     def _make_trace(parts, indent=4):
@@ -247,88 +323,138 @@ class PythonInstrumenter:
             else:
                 # String literal
                 args.append(repr(part))
-        prefix = " " * indent
-        return f"{prefix}print({', '.join(args)}, sep='\\0')"
+        call = f"print({', '.join(args)}, sep='\\0')"
+        return _indent(indent) + call.encode("utf-8")
 
-    def _block_indent(self, block_node):
-        """Return the column indent of the first statement inside a block."""
-        for child in block_node.children:
-            if child.is_named:
-                return child.start_point[1]
-        return 4
+    @staticmethod
+    def _first_statement(block_node):
+        """Return a block's first statement and the column it starts at.
+
+        A block with no statements yields ``(None, 4)``.
+        """
+        if not block_node.named_child_count:
+            return None, 4
+        first = block_node.named_child(0)
+        return first, first.start_point[1]
+
+    def _line_indent(self, line):
+        """Return the leading-whitespace width of source line ``line``."""
+        indent = self._line_indents.get(line)
+        if indent is None:
+            line_text = self.lines[line]
+            indent = self._line_indents[line] = len(line_text) - len(line_text.lstrip())
+        return indent
 
     def _build_output(self):
-        result = ["__tracer_depth = 0"]
-        for i, line in enumerate(self.lines):
-            if i in self.pre_insertions:
-                result.extend(self.pre_insertions[i])
-            result.append(line)
-            if i in self.insertions:
-                result.extend(self.insertions[i])
-        return "\n".join(result)
+        lines = self.lines
+        pre_insertions = self.pre_insertions
+        insertions = self.insertions
+        result = [b"__tracer_depth = 0"]
+        # Copy untouched runs of lines in one slice; only lines that carry
+        # insertions are handled one at a time.
+        prev = 0
+        for i in sorted(pre_insertions.keys() | insertions.keys()):
+            if i >= len(lines):
+                break
+            result.extend(lines[prev:i])
+            before = pre_insertions.get(i)
+            if before:
+                result.extend(before)
+            result.append(lines[i])
+            after = insertions.get(i)
+            if after:
+                result.extend(after)
+            prev = i + 1
+        result.extend(lines[prev:])
+        return b"\n".join(result)
 
     # ── AST traversal ────────────────────────────────────────────
 
-    def _traverse(self, node):
-        visitor = getattr(self, f"_visit_{node.type}", None)
-        if visitor:
-            visitor(node)
-
-        # Don't recurse into elif/else from top-level — handled by _visit_if_statement
-        if node.type == "if_statement":
-            # Only recurse into consequence block, not alternative
-            consequence = node.child_by_field_name("consequence")
-            if consequence:
-                for child in consequence.children:
-                    self._traverse(child)
-            # Handle alternative recursively via _handle_alternative
-            return
-
-        if node.type in ("elif_clause", "else_clause"):
-            # These are handled by _visit_if_statement's _handle_alternative
-            return
+    def _capture(self, root):
+        """Run the instrument query once; keep captures in pre-order."""
+        captured = [
+            (node.start_byte, -node.end_byte, name, node)
+            for name, nodes in QueryCursor(_INSTRUMENT_QUERY).captures(root).items()
+            for node in nodes
+        ]
+        captured.sort(key=_CAPTURE_ORDER)
+        self._captured = captured
+        self._capture_starts = [c[0] for c in captured]
 
-        for child in node.children:
-            self._traverse(child)
+    def _traverse(self, node):
+        """Visit the captured nodes inside ``node`` in pre-order."""
+        captured = self._captured
+        starts = self._capture_starts
+        dispatch = self._dispatch
+        i = bisect_left(starts, node.start_byte)
+        hi = bisect_left(starts, node.end_byte, i)
+        while i < hi:
+            _, _, name, child = captured[i]
+            i += 1
+            visitor = dispatch.get(name)
+            if visitor:
+                visitor(child)
+
+            if name == "if_statement":
+                # Only recurse into consequence block, not alternative
+                consequence = child.child_by_field_name("consequence")
+                if consequence:
+                    self._traverse(consequence)
+                # Alternatives are handled by _visit_if_statement
+                i = bisect_left(starts, child.end_byte, i, hi)
+            elif name == "elif_clause" or name == "else_clause":
+                # An if's elif/else is reached through _handle_alternative;
+                # for/while/try else bodies are not instrumented.
+                i = bisect_left(starts, child.end_byte, i, hi)
 
     def _collect_reads(self, node):
-        """Collect identifier names used in an expression (reads)."""
-        reads = []
+        """Collect identifier names used in an expression (reads).
 
-        def walk(n):
+        Each name is reported once, in order of first appearance.
+        """
+        code_bytes = self.code_bytes
+        exclude = self.EXCLUDE_IDENTS
+        keywords = _KEYWORD_BYTES
+        # raw name -> decoded name; only names that survive the keyword
+        # filter are decoded, once each
+        reads = {}
+        # Explicit pre-order stack of (node, parent) pairs; carrying the
+        # parent along saves a Node.parent lookup per identifier.
+        stack = [(node, node.parent)]
+        pop = stack.pop
+        push = stack.extend
+        while stack:
+            n, parent = pop()
             if n.type == "identifier":
-                parent = n.parent
-                if not parent or parent.type not in self.EXCLUDE_IDENTS:
-                    # Skip function names in call expressions
-                    if (
-                        parent
-                        and parent.type == "call"
-                        and parent.child_by_field_name("function") == n
-                    ):
-                        pass
-                    # Skip attribute names in attribute access (e.g., 'now' in 'datetime.now')
-                    elif (
-                        parent
-                        and parent.type == "attribute"
-                        and parent.child_by_field_name("attribute") == n
-                    ):
-                        pass
-                    # Skip keyword argument names (e.g., 'reverse' in 'sorted(..., reverse=True)')
-                    elif (
-                        parent
-                        and parent.type == "keyword_argument"
-                        and parent.child_by_field_name("name") == n
-                    ):
-                        pass
-                    else:
-                        name = get_text(n, self.code_bytes)
-                        if name not in KEYWORDS:
-                            reads.append(name)
-            for c in n.children:
-                walk(c)
-
-        walk(node)
-        return reads
+                parent_type = parent.type if parent else None
+                if parent_type in exclude:
+                    pass
+                # Skip function names in call expressions
+                elif (
+                    parent_type == "call"
+                    and parent.child_by_field_name("function") == n
+                ):
+                    pass
+                # Skip attribute names in attribute access (e.g., 'now' in 'datetime.now')
+                elif (
+                    parent_type == "attribute"
+                    and parent.child_by_field_name("attribute") == n
+                ):
+                    pass
+                # Skip keyword argument names (e.g., 'reverse' in 'sorted(..., reverse=True)')
+                elif (
+                    parent_type == "keyword_argument"
+                    and parent.child_by_field_name("name") == n
+                ):
+                    pass
+                else:
+                    raw = code_bytes[n.start_byte : n.end_byte]
+                    if raw not in keywords and raw not in reads:
+                        reads[raw] = get_ident(n, code_bytes)
+            children = n.children
+            if children:
+                push([(c, n) for c in reversed(children)])
+        return list(reads.values())
 
     # ── visitors ─────────────────────────────────────────────────
 
@@ -336,25 +462,20 @@ class PythonInstrumenter:
         func_name_node = node.child_by_field_name("name")
         if not func_name_node:
             return
-        func_name = get_text(func_name_node, self.code_bytes)
+        func_name = get_ident(func_name_node, self.code_bytes)
 
         params = []
         params_node = node.child_by_field_name("parameters")
         if params_node:
             for child in params_node.children:
                 if child.type == "identifier":
-                    params.append(get_text(child, self.code_bytes))
+                    params.append(get_ident(child, self.code_bytes))
 
         body = node.child_by_field_name("body")
         if not body:
             return
 
-        indent = self._block_indent(body)
-        first_stmt = None
-        for child in body.children:
-            if child.is_named:
-                first_stmt = child
-                break
+        first_stmt, indent = self._first_statement(body)
 
         if not first_stmt:
             return
@@ -368,8 +489,8 @@ class PythonInstrumenter:
                 self._add_before(start_line, trace)
 
         # Depth tracking
-        self._add_before(start_line, f"{' ' * indent}global __tracer_depth")
-        self._add_before(start_line, f"{' ' * indent}__tracer_depth += 1")
+        self._add_before(start_line, _indent(indent) + b"global __tracer_depth")
+        self._add_before(start_line, _indent(indent) + b"__tracer_depth += 1")
 
         # CALL trace
         parts: list = ["CALL", func_name]
@@ -382,7 +503,7 @@ class PythonInstrumenter:
         left = node.child_by_field_name("left")
         if not left or left.type != "identifier":
             return
-        var_name = get_text(left, self.code_bytes)
+        var_name = get_ident(left, self.code_bytes)
 
         line = node.start_point[0]
         col = node.start_point[1]
@@ -428,7 +549,7 @@ class PythonInstrumenter:
         left = node.child_by_field_name("left")
         if not left or left.type != "identifier":
             return
-        var_name = get_text(left, self.code_bytes)
+        var_name = get_ident(left, self.code_bytes)
 
         line = node.start_point[0]
         col = node.start_point[1]
@@ -488,12 +609,7 @@ class PythonInstrumenter:
         # BRANCH trace inside the if body
         consequence = node.child_by_field_name("consequence")
         if consequence:
-            indent = self._block_indent(consequence)
-            first_stmt = None
-            for child in consequence.children:
-                if child.is_named:
-                    first_stmt = child
-                    break
+            first_stmt, indent = self._first_statement(consequence)
             if first_stmt:
                 trace = self._make_trace(
                     [
@@ -512,16 +628,18 @@ class PythonInstrumenter:
         # a direct child of if_statement with no field name.
         alternative = node.child_by_field_name("alternative")
         if alternative:
-            self._handle_alternative(alternative, cond_text)
+            self._handle_alternative(alternative, safe_cond)
 
         # Also pick up else_clause siblings (not captured by 'alternative' field)
         for child in node.children:
             if child.type == "else_clause" and child != alternative:
-                self._handle_alternative(child, cond_text)
+                self._handle_alternative(child, safe_cond)
 
-    def _handle_alternative(self, node, parent_cond):
-        """Recursively handle elif_clause and else_clause nodes."""
-        safe_parent = parent_cond.replace("'", "\\'")
+    def _handle_alternative(self, node, safe_parent):
+        """Recursively handle elif_clause and else_clause nodes.
+
+        ``safe_parent`` is the enclosing condition, already quote-escaped.
+        """
 
         if node.type == "elif_clause":
             cond_node = node.child_by_field_name("condition")
@@ -530,12 +648,7 @@ class PythonInstrumenter:
 
             body = node.child_by_field_name("consequence")
             if body:
-                indent = self._block_indent(body)
-                first_stmt = None
-                for child in body.children:
-                    if child.is_named:
-                        first_stmt = child
-                        break
+                first_stmt, indent = self._first_statement(body)
                 if first_stmt:
                     trace = self._make_trace(
                         [
@@ -550,23 +663,17 @@ class PythonInstrumenter:
                     self._add_before(first_stmt.start_point[0], trace)
 
                 # Recurse into the elif body for nested statements
-                for child in body.children:
-                    self._traverse(child)
+                self._traverse(body)
 
             # Handle chained elif/else
             alt = node.child_by_field_name("alternative")
             if alt:
-                self._handle_alternative(alt, cond_text)
+                self._handle_alternative(alt, safe_cond)
 
         elif node.type == "else_clause":
             body = node.child_by_field_name("body")
             if body:
-                indent = self._block_indent(body)
-                first_stmt = None
-                for child in body.children:
-                    if child.is_named:
-                        first_stmt = child
-                        break
+                first_stmt, indent = self._first_statement(body)
                 if first_stmt:
                     trace = self._make_trace(
                         [
@@ -581,8 +688,7 @@ class PythonInstrumenter:
                     self._add_before(first_stmt.start_point[0], trace)
 
                 # Recurse into else body
-                for child in body.children:
-                    self._traverse(child)
+                self._traverse(body)
 
     def _visit_for_statement(self, node):
         line = node.start_point[0]
@@ -592,12 +698,7 @@ class PythonInstrumenter:
         if not body:
             return
 
-        indent = self._block_indent(body)
-        first_stmt = None
-        for child in body.children:
-            if child.is_named:
-                first_stmt = child
-                break
+        first_stmt, indent = self._first_statement(body)
 
         if not first_stmt:
             return
@@ -625,7 +726,7 @@ class PythonInstrumenter:
         # DECL for iteration variable
         left = node.child_by_field_name("left")
         if left and left.type == "identifier":
-            var_name = get_text(left, self.code_bytes)
+            var_name = get_ident(left, self.code_bytes)
             self.seen_vars.add(var_name)
             decl_trace = self._make_trace(
                 [
@@ -651,12 +752,7 @@ class PythonInstrumenter:
         if not body:
             return
 
-        indent = self._block_indent(body)
-        first_stmt = None
-        for child in body.children:
-            if child.is_named:
-                first_stmt = child
-                break
+        first_stmt, indent = self._first_statement(body)
 
         if not first_stmt:
             return
@@ -681,15 +777,11 @@ class PythonInstrumenter:
         col = node.start_point[1]
 
         # Find the return value expression (first named child after 'return')
-        ret_val = None
-        for child in node.children:
-            if child.is_named:
-                ret_val = child
-                break
+        ret_val = node.named_child(0) if node.named_child_count else None
 
         if ret_val:
             if ret_val.type == "identifier":
-                var_name = get_text(ret_val, self.code_bytes)
+                var_name = get_ident(ret_val, self.code_bytes)
                 if var_name not in KEYWORDS:
                     trace = self._make_trace(
                         [
@@ -718,7 +810,7 @@ class PythonInstrumenter:
                 )
                 self._add_before(line, trace)
 
-        self._add_before(line, f"{' ' * col}__tracer_depth -= 1")
+        self._add_before(line, _indent(col) + b"__tracer_depth -= 1")
 
     def _visit_call(self, node):
         """Handle function calls - mark external calls with EXTERNAL_CALL trace."""
@@ -727,28 +819,27 @@ class PythonInstrumenter:
             return
         
         # Get the function name (handle identifiers and attribute access)
-        func_name = None
+        name_node = None
         if func_node.type == "identifier":
-            func_name = get_text(func_node, self.code_bytes)
+            name_node = func_node
         elif func_node.type == "attribute":
             # For module.function() calls, get just the function name
-            attr_node = func_node.child_by_field_name("attribute")
-            if attr_node:
-                func_name = get_text(attr_node, self.code_bytes)
-        
-        if not func_name:
+            name_node = func_node.child_by_field_name("attribute")
+        if not name_node:
             return
-        
-        # Skip if it's a known keyword or built-in
-        if func_name in KEYWORDS:
+
+        # Skip if it's a known keyword or built-in; checked on the raw
+        # bytes so skipped names are never decoded
+        raw = self.code_bytes[name_node.start_byte : name_node.end_byte]
+        if not raw or raw in _KEYWORD_BYTES:
             return
-        
+        func_name = get_ident(name_node, self.code_bytes)
+
         # Check if this is an external function (not defined in current file)
         if func_name not in self.defined_functions:
             line = node.start_point[0]
             # Get indentation of the current line
-            line_text = self.lines[line]
-            indent = len(line_text) - len(line_text.lstrip())
+            indent = self._line_indent(line)
             trace = self._make_trace(
                 [
                     "EXTERNAL_CALL",
@@ -770,15 +861,23 @@ class PythonLanguage(LanguageSupport):
     extensions = frozenset({".py"})
 
     def get_ts_language(self):
-        return Language(language())
+        return _PY_LANGUAGE
 
-    def analyze_types(self, ts_parser, code_bytes):
-        return PythonTypeAnalyzer(ts_parser, code_bytes).analyze()
+    def analyze_types(self, ts_parser, code_bytes, tree=None):
+        return PythonTypeAnalyzer(ts_parser, code_bytes).analyze(tree)
 
-    def collect_metadata(self, ts_parser, code_bytes, source_file):
-        return PythonMetadataCollector(ts_parser, code_bytes, source_file).collect()
+    def collect_metadata(self, ts_parser, code_bytes, source_file, tree=None):
+        return PythonMetadataCollector(ts_parser, code_bytes, source_file).collect(
+            tree
+        )
 
-    def instrument(self, ts_parser, code_bytes, symbol_table, metadata):
-        return PythonInstrumenter(
+    def instrument(
+        self, ts_parser, code_bytes, symbol_table, metadata, out=None, tree=None
+    ):
+        code = PythonInstrumenter(
             ts_parser, code_bytes, symbol_table, metadata
-        ).instrument()
+        ).instrument(tree)
+        if out is None:
+            return code
+        out.write(code)
+        return None
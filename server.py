@@ -12,13 +12,16 @@ Then open http://localhost:5000 in your browser.
 """
 
 import os
-import json
+import shutil
 import sys
-import tempfile
-from pathlib import Path
-from flask import Flask, send_from_directory, jsonify, abort, request
+from flask import Flask, send_from_directory, jsonify, request
+
+from app import common, compress, frontend, json_provider
+from app.common import ALLOWED_EXTENSIONS, UPLOAD_CHUNK
 
 app = Flask(__name__)
+json_provider.init_app(app)
+compress.init_app(app)
 
 # ── paths ────────────────────────────────────────────────────────────
 BASE_DIR   = os.path.dirname(os.path.abspath(__file__))
@@ -28,18 +31,32 @@ JSON_DIR   = os.path.join(DATA_DIR, "json")
 PARSER_DIR = os.path.join(BASE_DIR, "parser")
 TESTS_DIR  = os.path.join(PARSER_DIR, "tests")
 
+# Make parser importable. The pipeline is imported here rather than per
+# request, so a preloaded app shares it with every forked worker.
+if PARSER_DIR not in sys.path:
+    sys.path.insert(0, PARSER_DIR)
+
+from run import deal_from_source  # noqa: E402
+
 
 # ── API: serve code files ────────────────────────────────────────────
 
 @app.route("/api/codefiles")
 def list_code_files():
     """List all available .c and .py source files in data/."""
-    if not os.path.isdir(DATA_DIR):
-        return jsonify([])
-    files = [f for f in os.listdir(DATA_DIR) 
-             if f.endswith((".c", ".py")) and os.path.isfile(os.path.join(DATA_DIR, f))]
-    files.sort()
-    return jsonify(files)
+    return common.code_files_response()
+
+
+@app.route("/api/traces")
+def list_traces():
+    """List the saved trace files in data/json/."""
+    return common.traces_response()
+
+
+@app.route("/api/trace/<path:filename>")
+def get_trace(filename):
+    """Serve a saved trace from data/json/ as-is."""
+    return common.trace_response(filename)
 
 
 @app.route("/api/upload", methods=["POST"])
@@ -52,14 +69,16 @@ def upload_file():
     if not file.filename:
         return jsonify({"success": False, "error": "No file selected"}), 400
 
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in (".c", ".py"):
+    if not file.filename.lower().endswith(ALLOWED_EXTENSIONS):
+        ext = os.path.splitext(file.filename)[1].lower()
         return jsonify({"success": False, "error": f"Unsupported file type '{ext}'. Only .c and .py files are accepted."}), 400
 
     # Save directly to DATA_DIR
     os.makedirs(DATA_DIR, exist_ok=True)
     file_path = os.path.join(DATA_DIR, file.filename)
-    file.save(file_path)
+    # Copied in 1 MiB chunks; FileStorage.save() uses 16 KiB ones
+    with open(file_path, "wb") as dst:
+        shutil.copyfileobj(file.stream, dst, length=UPLOAD_CHUNK)
 
     return jsonify({"success": True, "filename": file.filename})
 
@@ -74,32 +93,13 @@ def process_file():
     if not file.filename:
         return jsonify({"success": False, "error": {"stage": "upload", "message": "No file selected"}}), 400
 
-    ext = os.path.splitext(file.filename)[1].lower()
-    if ext not in (".c", ".py"):
+    if not file.filename.lower().endswith(ALLOWED_EXTENSIONS):
+        ext = os.path.splitext(file.filename)[1].lower()
         return jsonify({"success": False, "error": {"stage": "upload", "message": f"Unsupported file type '{ext}'. Only .c and .py files are accepted."}}), 400
 
-    # Add parser directory to path
-    if PARSER_DIR not in sys.path:
-        sys.path.insert(0, PARSER_DIR)
-
-    from run import deal
-
-    # Process in temp directory
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Save uploaded file to temp directory
-        src_path = os.path.join(tmpdir, file.filename)
-        file.save(src_path)
-
-        # Output JSON path in temp directory
-        stem = os.path.splitext(file.filename)[0]
-        out_path = os.path.join(tmpdir, f"{stem}.json")
-
-        # Run the full pipeline: instrument → compile → run → normalize
-        return_code = deal(src_path, output=out_path, seed=-1)
-
-        # Read the result
-        with open(out_path) as f:
-            result = json.load(f)
+    # Run the full pipeline (instrument → compile → run → normalize) on
+    # the uploaded bytes as they are
+    result = deal_from_source(file.stream.read(), file.filename, seed=-1)
 
     return jsonify(result)
 
@@ -107,108 +107,64 @@ def process_file():
 @app.route("/api/process", methods=["POST"])
 def process_code_files():
     """Process selected code files from data/ directory."""
-    data = request.get_json()
-    if not data or "files" not in data:
-        return jsonify({
-            "success": False,
-            "error": {"stage": "request", "message": "No files specified"}
-        }), 400
-
-    files = data["files"]
-    if not isinstance(files, list) or len(files) == 0:
-        return jsonify({
-            "success": False,
-            "error": {"stage": "request", "message": "Files must be a non-empty array"}
-        }), 400
-
-    # Add parser directory to path
-    if PARSER_DIR not in sys.path:
-        sys.path.insert(0, PARSER_DIR)
-
-    from run import deal
-
-    results = []
-    errors = []
-
-    for filename in files:
-        # Security check
-        if "/" in filename or "\\" in filename or ".." in filename:
-            errors.append({"file": filename, "stage": "validation", "message": "Invalid filename"})
-            continue
-
-        input_path = os.path.join(DATA_DIR, filename)
-        if not os.path.isfile(input_path):
-            errors.append({"file": filename, "stage": "validation", "message": "File not found"})
-            continue
-
-        # Process the file
-        try:
-            with tempfile.TemporaryDirectory() as tmpdir:
-                output_path = os.path.join(tmpdir, f"{os.path.splitext(filename)[0]}.json")
-                
-                # Run the parser
-                return_code = deal(input_path, output=output_path, seed=-1)
-                
-                # Read the result
-                with open(output_path) as f:
-                    result = json.load(f)
-
-                # ALWAYS include the result for visualization, even with no traces
-                # The frontend error panel will display compile/runtime errors
-                # Save to data/json directory
-                os.makedirs(JSON_DIR, exist_ok=True)
-                save_name = f"{os.path.splitext(filename)[0]}.json"
-                save_path = os.path.join(JSON_DIR, save_name)
-                with open(save_path, "w") as f:
-                    json.dump(result, f, indent=2)
-                
-                is_success = result.get("success", False)
-                results.append({
-                    "file": filename,
-                    "output": save_name,
-                    "success": is_success,
-                    "data": result,  # Include result regardless of success or traces
-                    "warning": result.get("error", {}).get("message") if not is_success else None
-                })
-
-        except Exception as e:
-            errors.append({
-                "file": filename,
-                "stage": "processing",
-                "message": str(e)
-            })
-
-    # Return results - always return 200 if we have any results (even with warnings)
-    # This allows visualization to proceed even with runtime errors
-    if len(results) > 0:
-        return jsonify({
-            "success": True,
-            "processed": len(results),
-            "results": results,
-            "errors": errors if errors else None
-        })
-    
-    # Only return error status if we have zero results
-    return jsonify({
-        "success": False,
-        "errors": errors
-    }), 400
+    # ALWAYS include the result for visualization, even with no traces;
+    # the frontend error panel will display compile/runtime errors
+    return common.process_response(request.get_json(), keep_failed=True)
 
 
 # ── Static files: serve the front-end ────────────────────────────────
 
 @app.route("/")
 def index():
-    return send_from_directory(STATIC_DIR, "index.html")
+    # Revalidated on every load; an unchanged copy costs a bodiless 304
+    return send_from_directory(STATIC_DIR, "index.html", max_age=0)
 
 
 @app.route("/<path:path>")
 def static_files(path):
-    return send_from_directory(STATIC_DIR, path)
+    # data/ is rewritten while the app runs, so only front-end assets are
+    # cached; everything still answers If-None-Match/If-Modified-Since
+    max_age = None if path.startswith("data/") else frontend.MAX_AGE
+    return send_from_directory(STATIC_DIR, path, max_age=max_age)
+
+
+# Front-end assets go through WhiteNoise when it is installed; the routes
+# above still serve data/ and act as the fallback
+frontend.init_app(app, STATIC_DIR)
 
 
 # ── Run ──────────────────────────────────────────────────────────────
 
+def _serve_production():
+    """Replace this process with gunicorn serving ``server:app``.
+
+    ``--preload`` imports the app once and forks the workers from it;
+    gthread workers keep serving while a request waits on gcc or a
+    traced program. Each worker starts its own /api/process pool, so
+    unless SPIRAL_PROCESS_WORKERS says otherwise each pool gets a single
+    process: at most one pipeline run per web worker, host-wide.
+    """
+    gunicorn = shutil.which("gunicorn")
+    if gunicorn is None:
+        sys.exit("SPIRAL_PROD=1 needs gunicorn: pip install gunicorn")
+    workers = str((os.cpu_count() or 1) * 2)
+    os.environ.setdefault("SPIRAL_PROCESS_WORKERS", "1")
+    os.execv(gunicorn, [
+        gunicorn, "server:app",
+        "--preload",
+        "--workers", workers,
+        "--worker-class", "gthread",
+        "--threads", "4",
+        "--bind", "0.0.0.0:5000",
+        "--chdir", BASE_DIR,
+    ])
+
+
 if __name__ == "__main__":
+    if os.environ.get("SPIRAL_PROD") == "1":
+        _serve_production()
     print(" Code Mosaic server running at http://localhost:5000")
-    app.run(debug=True, port=5000)
+    # The reloader imports everything twice and the debugger slows every
+    # error, so both are opt-in
+    debug = os.environ.get("SPIRAL_DEBUG") == "1"
+    app.run(debug=debug, port=5000, threaded=True)
@@ -0,0 +1,61 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+# server.py and the app package live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import common, create_app  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Point the API at an empty data/ directory under ``tmp_path``."""
+    data = tmp_path / "data"
+    data.mkdir()
+    json_dir = data / "json"
+    monkeypatch.setattr(common, "DATA_DIR", data)
+    monkeypatch.setattr(common, "JSON_DIR", json_dir)
+    monkeypatch.setattr(common, "_DATA_PREFIX", f"{data}{os.sep}")
+    monkeypatch.setattr(common, "_JSON_PREFIX", f"{json_dir}{os.sep}")
+    for cache in (common._code_listing, common._trace_listing, common._data_files):
+        monkeypatch.setitem(cache, "mtime_ns", None)
+    return data
+
+
+def _use_executor(monkeypatch, executor):
+    monkeypatch.setattr(common, "_executor", executor)
+    return executor
+
+
+@pytest.fixture
+def thread_pool(monkeypatch):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield _use_executor(monkeypatch, executor)
+
+
+@pytest.fixture
+def process_pool(monkeypatch):
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        yield _use_executor(monkeypatch, executor)
+
+
+@pytest.fixture(params=["app", "server"])
+def client(request):
+    """A test client for the app factory or for the standalone server.py.
+
+    ``client.keeps_failed`` says whether failed runs come back as results.
+    """
+    if request.param == "app":
+        flask_app = create_app()
+    else:
+        import server
+
+        flask_app = server.app
+    test_client = flask_app.test_client()
+    test_client.keeps_failed = request.param == "server"
+    return test_client
+
@@ -0,0 +1,67 @@
+import gzip
+import json
+import zlib
+
+import pytest
+
+import server
+from app import compress, routes
+
+TRACE = {
+    "success": True,
+    "traces": [{"type": "ASSIGN", "name": "x", "value": i} for i in range(500)],
+}
+
+
+@pytest.fixture
+def trace_file(tmp_path, monkeypatch):
+    """Serve static files from ``tmp_path``, with one trace in data/json."""
+    for module in (routes, server):
+        monkeypatch.setattr(module, "STATIC_DIR", str(tmp_path))
+    json_dir = tmp_path / "data" / "json"
+    json_dir.mkdir(parents=True)
+    body = json.dumps(TRACE).encode()
+    (json_dir / "prog.json").write_bytes(body)
+    return body
+
+
+def _get(client, url, headers=None):
+    with client.get(url, headers=headers) as response:
+        response.get_data()
+    return response
+
+
+def test_stream_chunks_decompress_as_they_arrive():
+    chunks = [b'{"traces": [', b'{"type": "ASSIGN"}', b"]}"]
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    stream = compress._gzip_stream(iter(chunks))
+    for chunk in chunks:
+        # Each chunk can be decoded before the next one is produced
+        assert decompressor.decompress(next(stream)) == chunk
+    decompressor.decompress(b"".join(stream))
+    assert decompressor.eof
+
+
+def test_gzipped_file_gets_its_own_etag(client, trace_file):
+    url = "/data/json/prog.json"
+    plain = _get(client, url)
+    gzipped = _get(client, url, {"Accept-Encoding": "gzip"})
+    assert plain.get_data() == trace_file
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzipped.get_data()) == trace_file
+    assert gzipped.headers["ETag"] != plain.headers["ETag"]
+    assert "Accept-Ranges" not in gzipped.headers
+
+    # A tag is only good for revalidating the body it came with
+    revalidated = _get(
+        client, url, {"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]}
+    )
+    assert revalidated.status_code == 304
+    # Without gzip the -gz tag matches nothing, so the plain body is sent
+    plain_again = _get(client, url, {"If-None-Match": gzipped.headers["ETag"]})
+    assert plain_again.status_code == 200
+    assert plain_again.get_data() == trace_file
+    # The plain tag still revalidates the plain copy, even from a gzip client
+    kept = _get(client, url, {"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+    assert kept.status_code == 304
+    assert kept.headers["ETag"] == plain.headers["ETag"]
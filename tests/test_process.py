@@ -0,0 +1,228 @@
+import json
+import os
+import shutil
+import signal
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app import common
+
+C_SOURCE = """#include <stdio.h>
+
+int main() {
+    int total = 0;
+    for (int i = 0; i < 3; i++) {
+        total += i;
+    }
+    printf("%d\\n", total);
+    return 0;
+}
+"""
+
+needs_gcc = pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not installed")
+
+
+def _ok(path):
+    return {"success": True, "metadata": {}, "traces": [{"path": path}], "seed": 1}
+
+
+def _failed(path):
+    return {
+        "success": False,
+        "error": {"stage": "runtime", "message": "Program exited with code 1"},
+        "metadata": {},
+        "traces": [],
+    }
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """Replace the pipeline with one that fails for names containing "bad".
+
+    Returns the list of paths it was called with.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def deal_to_dict(path, seed=None, scratch=False):
+        assert scratch, "API runs must use a private scratch directory"
+        with lock:
+            calls.append(path)
+        return _failed(path) if "bad" in path else _ok(path)
+
+    monkeypatch.setattr(common, "deal_to_dict", deal_to_dict)
+    return calls
+
+
+def _post(client, files):
+    response = client.post("/api/process", json={"files": files})
+    # Streamed or not, the body must be one well-formed JSON object
+    return response.status_code, json.loads(response.get_data())
+
+
+def _touch(data_dir, *names):
+    for name in names:
+        (data_dir / name).write_text("int main() { return 0; }\n")
+
+
+# ── duplicates and parallel runs ────────────────────────────────────
+
+def test_duplicate_names_run_once(client, data_dir, thread_pool, fake_pipeline):
+    _touch(data_dir, "a.c", "b.c")
+    status, body = _post(client, ["a.c", "b.c", "a.c", "a.c"])
+    assert status == 200
+    assert sorted(fake_pipeline) == sorted([str(data_dir / "a.c"), str(data_dir / "b.c")])
+    assert [r["file"] for r in body["results"]] == ["a.c", "b.c", "a.c", "a.c"]
+    assert body["processed"] == 4
+    assert all(r["data"]["traces"] for r in body["results"])
+
+
+def test_single_file_listed_twice_runs_once(client, data_dir, fake_pipeline):
+    _touch(data_dir, "a.c")
+    status, body = _post(client, ["a.c", "a.c"])
+    assert status == 200
+    assert fake_pipeline == [str(data_dir / "a.c")]
+    assert body["processed"] == 2
+
+
+@needs_gcc
+def test_parallel_runs_of_one_file_do_not_collide(client, data_dir, process_pool):
+    (data_dir / "loop.c").write_text(C_SOURCE)
+    (data_dir / "other.c").write_text(C_SOURCE)
+    status, body = _post(client, ["loop.c", "other.c", "loop.c", "other.c"])
+    assert status == 200
+    assert body["errors"] is None
+    results = body["results"]
+    assert [r["success"] for r in results] == [True] * 4
+    assert len({len(r["data"]["traces"]) for r in results}) == 1
+    # Build artifacts stay in scratch directories, and saves are atomic
+    assert not (data_dir / "output").exists()
+    assert sorted(p.name for p in (data_dir / "json").iterdir()) == ["loop.json", "other.json"]
+    saved = json.loads((data_dir / "json" / "loop.json").read_text())
+    assert saved["success"] and saved["traces"]
+
+
+@pytest.fixture
+def real_pool(monkeypatch):
+    """Let the API start its own pool; shut down whatever it started."""
+    monkeypatch.setattr(common, "_executor", None)
+    yield
+    if common._executor is not None:
+        common._executor.shutdown(cancel_futures=True)
+
+
+@needs_gcc
+def test_dead_pool_worker_is_replaced(client, data_dir, real_pool):
+    (data_dir / "loop.c").write_text(C_SOURCE)
+    (data_dir / "other.c").write_text(C_SOURCE)
+    assert _post(client, ["loop.c", "other.c"])[0] == 200
+    executor = common._executor
+    workers = list(executor._processes.values())
+    for worker in workers:
+        os.kill(worker.pid, signal.SIGKILL)
+    for worker in workers:
+        worker.join(5)
+    time.sleep(0.2)
+    for _ in range(2):
+        status, body = _post(client, ["loop.c", "other.c"])
+        assert status == 200
+        assert [r["success"] for r in body["results"]] == [True, True]
+    assert common._executor is not executor
+
+
+class _BrokenPool:
+    """An executor whose workers have all died mid-run."""
+
+    def __init__(self):
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        future.set_exception(BrokenProcessPool("a worker died"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def test_runs_lost_with_the_pool_are_run_again(client, data_dir, monkeypatch, fake_pipeline):
+    _touch(data_dir, "a.c", "b.c", "c.c")
+    broken = _BrokenPool()
+    monkeypatch.setattr(common, "_executor", broken)
+    # The replacement pool also dies, so everything ends up run inline
+    monkeypatch.setattr(common, "ProcessPoolExecutor", lambda **kwargs: _BrokenPool())
+    status, body = _post(client, ["a.c", "b.c", "c.c"])
+    assert status == 200
+    assert [r["file"] for r in body["results"]] == ["a.c", "b.c", "c.c"]
+    assert sorted(fake_pipeline) == [str(data_dir / n) for n in ("a.c", "b.c", "c.c")]
+    assert broken.shut_down
+    assert common._executor is not broken
+
+
+# ── status and summary ──────────────────────────────────────────────
+
+def test_all_runs_failing_is_a_400(client, data_dir, thread_pool, fake_pipeline):
+    _touch(data_dir, "bad1.c", "bad2.c")
+    status, body = _post(client, ["bad1.c", "bad2.c", "missing.c"])
+    if client.keeps_failed:
+        # server.py returns failed runs as results, with a warning
+        assert status == 200
+        assert body["success"] is True
+        assert body["processed"] == 2
+        assert all(r["warning"] for r in body["results"])
+    else:
+        assert status == 400
+        assert body["success"] is False
+        assert "results" not in body
+        assert sorted(e["file"] for e in body["errors"]) == ["bad1.c", "bad2.c", "missing.c"]
+
+
+def test_single_failing_run_is_a_400(client, data_dir, fake_pipeline):
+    _touch(data_dir, "bad.c")
+    status, body = _post(client, ["bad.c"])
+    assert status == (200 if client.keeps_failed else 400)
+
+
+def test_mixed_results_summary(client, data_dir, thread_pool, fake_pipeline):
+    _touch(data_dir, "bad.c", "good.c")
+    status, body = _post(client, ["bad.c", "good.c", "missing.c"])
+    assert status == 200
+    assert body["success"] is True
+    errors = {e["file"]: e["stage"] for e in body["errors"]}
+    if client.keeps_failed:
+        assert [r["file"] for r in body["results"]] == ["bad.c", "good.c"]
+        assert errors == {"missing.c": "validation"}
+    else:
+        assert [r["file"] for r in body["results"]] == ["good.c"]
+        assert errors == {"missing.c": "validation", "bad.c": "runtime"}
+    assert body["processed"] == len(body["results"])
+    good = body["results"][-1]
+    assert good["output"] == "good.json"
+    assert good["data"] == json.loads((data_dir / "json" / "good.json").read_text())
+
+
+def test_all_successful_summary(client, data_dir, thread_pool, fake_pipeline):
+    _touch(data_dir, "a.c", "b.c")
+    status, body = _post(client, ["a.c", "b.c"])
+    assert status == 200
+    assert body["success"] is True
+    assert body["processed"] == 2
+    assert body["errors"] is None
+
+
+def test_validation_failures_are_a_400(client, data_dir, fake_pipeline):
+    status, body = _post(client, ["../etc/passwd", "missing.c"])
+    assert status == 400
+    assert [e["message"] for e in body["errors"]] == ["Invalid filename", "File not found"]
+    assert fake_pipeline == []
+
+
+def test_new_upload_is_found(client, data_dir, fake_pipeline):
+    _touch(data_dir, "a.c")
+    assert _post(client, ["a.c"])[0] == 200
+    _touch(data_dir, "b.c")
+    assert _post(client, ["b.c"])[0] == 200